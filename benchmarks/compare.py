@@ -0,0 +1,66 @@
+"""benchmarks/compare.py
+
+Diff two result files produced by `benchmarks.pipeline`.
+
+Usage:
+    python -m benchmarks.compare benchmarks/results/<old>.json benchmarks/results/<new>.json
+"""
+
+import argparse
+import json
+import sys
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+
+def flatten(data: Dict[str, Any], prefix: str = "") -> Dict[str, float]:
+    """
+    Flatten nested result dictionaries into `a.b.c -> number`, ignoring non-numeric values.
+    """
+    flat: Dict[str, float] = {}
+    for key, value in data.items():
+        name = f"{prefix}.{key}" if prefix else key
+        if isinstance(value, dict):
+            flat.update(flatten(value, name))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[name] = value
+    return flat
+
+
+def compare(old: Dict[str, Any], new: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """
+    Return one row per metric present in either run, with the relative change in percent.
+    """
+    old_flat = flatten({k: v for k, v in old.items() if k != "meta"})
+    new_flat = flatten({k: v for k, v in new.items() if k != "meta"})
+
+    rows = []
+    for metric in sorted(set(old_flat) | set(new_flat)):
+        before, after = old_flat.get(metric), new_flat.get(metric)
+        change: Optional[float] = None
+        if before is not None and after is not None and before != 0:
+            change = round((after - before) / abs(before) * 100, 2)
+        rows.append({"metric": metric, "old": before, "new": after, "change_pct": change})
+    return rows
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Compare two benchmark result files.")
+    parser.add_argument("old", type=Path)
+    parser.add_argument("new", type=Path)
+    args = parser.parse_args(argv)
+
+    old = json.loads(args.old.read_text(encoding="utf-8"))
+    new = json.loads(args.new.read_text(encoding="utf-8"))
+
+    print(f"old: {old['meta'].get('commit')}  new: {new['meta'].get('commit')}")
+    rows = compare(old, new)
+    width = max((len(row["metric"]) for row in rows), default=0)
+    for row in rows:
+        change = "" if row["change_pct"] is None else f"{row['change_pct']:+.2f}%"
+        print(f"{row['metric']:<{width}}  {str(row['old']):>12}  {str(row['new']):>12}  {change:>10}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,111 @@
+"""benchmarks/import_time.py
+
+Startup-time budget for the API and worker processes.
+
+Each module is imported in a fresh interpreter with `python -X importtime`, a few times,
+and the median cumulative import time is compared with its budget. The exit status is 1
+if any module is over budget, so the check can run in CI next to the linters.
+
+Usage:
+    python -m benchmarks.import_time
+    python -m benchmarks.import_time --budget main=1250 --budget worker=1000 --runs 7
+
+Importing `main` also builds the FastAPI app, and importing `worker` builds its settings,
+so the numbers cover everything a new process does before it can serve a request or
+pick up a job.
+"""
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+
+# Milliseconds: the medians after the API stopped importing the task code (about 1100 ms
+# and 900 ms), plus 10% for noise. Lower them when an import gets cheaper.
+DEFAULT_BUDGETS_MS = {"main": 1250.0, "worker": 1000.0}
+
+
+def import_times(module: str) -> Tuple[float, Dict[str, float]]:
+    """
+    Import `module` in a fresh interpreter.
+
+    Returns:
+        Tuple[float, Dict[str, float]]: The cumulative import time of `module` and the
+                                        self time of every module it pulled in, in ms.
+    """
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=REPO_ROOT,
+        env={**os.environ, "PYTHONDONTWRITEBYTECODE": "1"},
+        capture_output=True,
+        text=True,
+    )
+    if proc.returncode != 0:
+        raise SystemExit(f"import {module} failed:\n{proc.stderr}")
+
+    total = None
+    self_times: Dict[str, float] = {}
+    for line in proc.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:") :].split("|", 2)
+        name = name.strip()
+        self_times[name] = self_times.get(name, 0.0) + int(self_us) / 1000
+        if name == module:
+            total = int(cumulative_us) / 1000
+    if total is None:
+        raise SystemExit(f"no import time reported for {module}")
+    return total, self_times
+
+
+def measure(module: str, runs: int) -> Tuple[float, List[Tuple[str, float]]]:
+    """
+    Median cumulative import time over `runs` imports, plus the slowest modules of the median run.
+    """
+    samples = sorted((import_times(module) for _ in range(runs)), key=lambda sample: sample[0])
+    median_total = statistics.median(total for total, _ in samples)
+    _, self_times = samples[len(samples) // 2]
+    slowest = sorted(self_times.items(), key=lambda item: item[1], reverse=True)
+    return median_total, slowest
+
+
+def parse_budget(value: str) -> Tuple[str, float]:
+    module, sep, ms = value.partition("=")
+    if not sep:
+        raise argparse.ArgumentTypeError(f"expected MODULE=MS, got {value!r}")
+    return module, float(ms)
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--budget", type=parse_budget, action="append", default=[], help="MODULE=MS, overrides the default budget of a module")
+    parser.add_argument("--runs", type=int, default=5, help="imports per module, the median is compared with the budget")
+    parser.add_argument("--top", type=int, default=10, help="number of slowest modules to list")
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = parse_args(argv)
+    budgets = {**DEFAULT_BUDGETS_MS, **dict(args.budget)}
+
+    over_budget = []
+    for module, budget in budgets.items():
+        total, slowest = measure(module, args.runs)
+        verdict = "ok" if total <= budget else "OVER BUDGET"
+        print(f"{module}: {total:.0f} ms (budget {budget:.0f} ms) {verdict}")
+        for name, ms in slowest[: args.top]:
+            print(f"    {ms:8.1f} ms  {name}")
+        if total > budget:
+            over_budget.append(module)
+
+    return 1 if over_budget else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,352 @@
+"""benchmarks/pipeline.py
+
+Load-generation and latency benchmark for the enqueue -> execute -> status pipeline.
+
+The FastAPI app (`main.app`) is driven in-process through httpx's ASGI transport, and a
+real ARQ worker built from `worker.WorkerSettings` runs in the same event loop. By default
+both share a `fakeredis` server, so no Redis installation is needed; pass `--redis host:port`
+to benchmark against a local redis-server instead.
+
+Usage:
+    python -m benchmarks.pipeline --mix benchmarks/mix.jsonl --requests 200 --concurrency 20
+
+Each line of the mix file is a JSON object describing one kind of request:
+    {"name": "divide", "method": "POST", "path": "/tasks/divide", "json": {...}, "params": {...}, "weight": 8}
+
+Results are written as JSON (see `--output`) so they can be diffed between commits with
+`python -m benchmarks.compare old.json new.json`.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+DEFAULT_MIX = Path(__file__).parent / "mix.jsonl"
+DEFAULT_RESULTS_DIR = Path(__file__).parent / "results"
+
+
+def load_mix(path: Path) -> List[Dict[str, Any]]:
+    """
+    Load a request mix from a JSONL file, skipping blank lines and `#` comments.
+    """
+    entries = []
+    with open(path, encoding="utf-8") as fh:
+        for line_no, line in enumerate(fh, start=1):
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            entry = json.loads(line)
+            if "path" not in entry:
+                raise ValueError(f"{path}:{line_no}: mix entry is missing 'path'")
+            entry.setdefault("name", entry["path"])
+            entry.setdefault("method", "POST")
+            entry.setdefault("weight", 1)
+            entries.append(entry)
+    if not entries:
+        raise ValueError(f"{path}: request mix is empty")
+    return entries
+
+
+def build_schedule(mix: List[Dict[str, Any]], total: int, seed: int) -> List[Dict[str, Any]]:
+    """
+    Draw `total` requests from the weighted mix. A fixed seed keeps runs reproducible.
+    """
+    rng = random.Random(seed)
+    weights = [float(entry["weight"]) for entry in mix]
+    return rng.choices(mix, weights=weights, k=total)
+
+
+def percentiles(samples: List[float]) -> Dict[str, Optional[float]]:
+    """
+    Summarise a list of samples (milliseconds) with nearest-rank percentiles.
+    """
+    if not samples:
+        return {"count": 0, "mean": None, "p50": None, "p90": None, "p95": None, "p99": None, "max": None}
+
+    ordered = sorted(samples)
+
+    def rank(p: float) -> float:
+        index = max(0, min(len(ordered) - 1, int(round(p / 100 * len(ordered) + 0.5)) - 1))
+        return round(ordered[index], 3)
+
+    return {
+        "count": len(ordered),
+        "mean": round(sum(ordered) / len(ordered), 3),
+        "p50": rank(50),
+        "p90": rank(90),
+        "p95": rank(95),
+        "p99": rank(99),
+        "max": round(ordered[-1], 3),
+    }
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def make_fake_pool(queue_name: str):
+    """
+    Create an `ArqRedis` client backed by an in-memory fakeredis server.
+    """
+    try:
+        from fakeredis import FakeServer
+        from fakeredis.aioredis import FakeAsyncRedisMixin
+    except ImportError as exc:  # pragma: no cover - depends on the local environment
+        raise SystemExit("fakeredis is required for the in-memory benchmark: pip install fakeredis (or pass --redis host:port)") from exc
+
+    import arq.worker
+    from arq.connections import ArqRedis
+
+    # fakeredis does not implement INFO, which the worker only uses to log server details on startup.
+    async def skip_redis_info(redis, log_func) -> None:
+        log_func("redis_version=fakeredis")
+
+    arq.worker.log_redis_info = skip_redis_info
+
+    class FakeArqRedis(FakeAsyncRedisMixin, ArqRedis):
+        pass
+
+    pool = FakeArqRedis(server=FakeServer())
+    # The fakeredis mixin builds the client kwargs itself, so ArqRedis never sees default_queue_name
+    pool.default_queue_name = queue_name
+    return pool
+
+
+async def enqueue_phase(client, schedule: List[Dict[str, Any]], concurrency: int) -> Dict[str, Any]:
+    """
+    Replay the schedule against the enqueue endpoints and record per-request latency.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies: List[float] = []
+    jobs: List[Dict[str, Any]] = []
+    errors = 0
+
+    async def send(entry: Dict[str, Any]) -> None:
+        nonlocal errors
+        async with semaphore:
+            started = time.perf_counter()
+            response = await client.request(entry["method"], entry["path"], json=entry.get("json"), params=entry.get("params"))
+            latencies.append((time.perf_counter() - started) * 1000)
+        if response.status_code == 200:
+            jobs.append({"job_id": response.json()["job_id"], "name": entry["name"]})
+        else:
+            errors += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(send(entry) for entry in schedule))
+    duration = time.perf_counter() - started
+
+    return {
+        "jobs": jobs,
+        "stats": {
+            "count": len(schedule),
+            "errors": errors,
+            "duration_s": round(duration, 3),
+            "throughput_rps": round(len(schedule) / duration, 2) if duration else None,
+            "latency_ms": percentiles(latencies),
+        },
+    }
+
+
+async def status_poll_phase(client, job_ids: List[str], concurrency: int, duration: float) -> Dict[str, Any]:
+    """
+    Hammer `GET /jobs/{job_id}` round-robin over the enqueued jobs for `duration` seconds.
+    """
+    latencies: List[float] = []
+    errors = 0
+    deadline = time.perf_counter() + duration
+    cursor = 0
+
+    async def poller() -> None:
+        nonlocal errors, cursor
+        while time.perf_counter() < deadline:
+            job_id = job_ids[cursor % len(job_ids)]
+            cursor += 1
+            started = time.perf_counter()
+            response = await client.get(f"/jobs/{job_id}")
+            latencies.append((time.perf_counter() - started) * 1000)
+            if response.status_code != 200:
+                errors += 1
+
+    started = time.perf_counter()
+    if job_ids:
+        await asyncio.gather(*(poller() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+
+    return {
+        "count": len(latencies),
+        "errors": errors,
+        "duration_s": round(elapsed, 3),
+        "rps": round(len(latencies) / elapsed, 2) if elapsed else None,
+        "latency_ms": percentiles(latencies),
+    }
+
+
+async def wait_for_results(pool, jobs: List[Dict[str, Any]], timeout: float, worker_task: asyncio.Task) -> Dict[str, Any]:
+    """
+    Wait until every job has a result in Redis (or the timeout passes) and collect the
+    enqueue/start/finish timestamps ARQ recorded for each of them.
+    """
+    from arq.jobs import Job
+
+    pending = {job["job_id"]: job["name"] for job in jobs}
+    results: Dict[str, Any] = {}
+    deadline = time.monotonic() + timeout
+
+    while pending and time.monotonic() < deadline:
+        if worker_task.done():
+            # Surface the worker's exception instead of waiting out the timeout
+            worker_task.result()
+            raise RuntimeError("ARQ worker stopped before all jobs finished")
+        for job_id in list(pending):
+            info = await Job(job_id, pool).result_info()
+            if info is not None:
+                results[job_id] = (pending.pop(job_id), info)
+        if pending:
+            await asyncio.sleep(0.1)
+
+    to_start: List[float] = []
+    end_to_end: List[float] = []
+    by_name: Dict[str, List[float]] = {}
+    failed = 0
+    for name, info in results.values():
+        queued_ms = (info.start_time - info.enqueue_time).total_seconds() * 1000
+        total_ms = (info.finish_time - info.enqueue_time).total_seconds() * 1000
+        to_start.append(queued_ms)
+        end_to_end.append(total_ms)
+        by_name.setdefault(name, []).append(total_ms)
+        if not info.success:
+            failed += 1
+
+    return {
+        "jobs": {"completed": len(results) - failed, "failed": failed, "incomplete": len(pending)},
+        "enqueue_to_start_ms": percentiles(to_start),
+        "end_to_end_ms": percentiles(end_to_end),
+        "end_to_end_by_request_ms": {name: percentiles(samples) for name, samples in sorted(by_name.items())},
+    }
+
+
+async def run(args: argparse.Namespace) -> Dict[str, Any]:
+    # Settings are read at import time, so the environment has to be in place
+    # before any application module is imported.
+    workdir = tempfile.mkdtemp(prefix="fastapi-arq-bench-")
+    os.environ["JOBS_DB"] = str(Path(workdir) / "jobs.db")
+    if args.redis:
+        os.environ["REDIS_BROKER"] = args.redis
+    # Every request comes from the same client: measure the pipeline, not the admission limits
+    os.environ.setdefault("RATE_LIMIT_PER_SECOND", "0")
+    os.environ.setdefault("QUEUE_HIGH_WATERMARK", "0")
+
+    import httpx
+    from arq.worker import create_worker
+
+    import main as api
+    import worker
+    from database.models import configure
+    from redis_pool import get_redis_pool
+
+    # The API no longer creates the schema on startup (see database/migrate.py)
+    configure()
+
+    config = api.config
+    if args.redis:
+        from arq import create_pool
+
+        pool = await create_pool(worker.REDIS_SETTINGS, default_queue_name=config.WORKER_QUEUE)
+    else:
+        pool = make_fake_pool(config.WORKER_QUEUE)
+
+        async def get_fake_redis_pool():
+            yield pool
+
+        api.app.dependency_overrides[get_redis_pool] = get_fake_redis_pool
+
+    await pool.flushdb()
+
+    arq_worker = create_worker(worker.WorkerSettings, redis_pool=pool, handle_signals=False, burst=False)
+    worker_task = asyncio.create_task(arq_worker.async_run())
+
+    schedule = build_schedule(load_mix(args.mix), args.requests, args.seed)
+
+    transport = httpx.ASGITransport(app=api.app)
+    try:
+        async with api.app.router.lifespan_context(api.app):
+            async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+                enqueued = await enqueue_phase(client, schedule, args.concurrency)
+                job_ids = [job["job_id"] for job in enqueued["jobs"]]
+                status_poll = await status_poll_phase(client, job_ids, args.poll_concurrency, args.poll_duration)
+                completion = await wait_for_results(pool, enqueued["jobs"], args.timeout, worker_task)
+    finally:
+        worker_task.cancel()
+        try:
+            await worker_task
+        except asyncio.CancelledError:
+            pass
+        await arq_worker.close()
+        api.app.dependency_overrides.clear()
+
+    return {
+        "meta": {
+            "commit": git_commit(),
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "python": platform.python_version(),
+            "redis": args.redis or "fakeredis",
+            "mix": str(args.mix),
+            "requests": args.requests,
+            "concurrency": args.concurrency,
+            "poll_concurrency": args.poll_concurrency,
+            "poll_duration_s": args.poll_duration,
+            "seed": args.seed,
+            "max_jobs": worker.WorkerSettings.max_jobs,
+        },
+        "enqueue": enqueued["stats"],
+        "status_poll": status_poll,
+        **completion,
+    }
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Benchmark the enqueue -> execute -> status pipeline.")
+    parser.add_argument("--mix", type=Path, default=DEFAULT_MIX, help="JSONL file describing the request mix")
+    parser.add_argument("--requests", type=int, default=200, help="number of enqueue requests to send")
+    parser.add_argument("--concurrency", type=int, default=20, help="concurrent enqueue requests")
+    parser.add_argument("--poll-concurrency", type=int, default=10, help="concurrent status pollers")
+    parser.add_argument("--poll-duration", type=float, default=5.0, help="seconds to spend polling job status")
+    parser.add_argument("--timeout", type=float, default=120.0, help="seconds to wait for all jobs to finish")
+    parser.add_argument("--seed", type=int, default=0, help="random seed for drawing requests from the mix")
+    parser.add_argument("--redis", default=None, help="host:port of a real Redis server (defaults to fakeredis)")
+    parser.add_argument("--output", type=Path, default=None, help="where to write the JSON results")
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = parse_args(argv)
+    results = asyncio.run(run(args))
+
+    output = args.output
+    if output is None:
+        commit = (results["meta"]["commit"] or "unknown")[:12]
+        output = DEFAULT_RESULTS_DIR / f"{commit}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(results, indent=2) + "\n", encoding="utf-8")
+
+    print(json.dumps(results, indent=2))
+    print(f"Results written to {output}", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
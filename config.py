@@ -1,5 +1,7 @@
 from functools import lru_cache
+from typing import Dict, Literal
 
+from arq.connections import RedisSettings
 from pydantic import Field, model_validator
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
@@ -21,6 +23,85 @@ class Settings(BaseSettings):
         description="SQLAlchemy database URL for jobs",
     )
 
+    # Adaptive worker concurrency (used by `python worker.py`)
+    WORKER_MIN_JOBS: int = Field(
+        10,
+        description="Lower bound for the number of jobs a worker runs at the same time",
+    )
+
+    WORKER_MAX_JOBS: int = Field(
+        1000,
+        description="Upper bound for the number of jobs a worker runs at the same time",
+    )
+
+    WORKER_TARGET_LOOP_LAG_MS: float = Field(
+        50.0,
+        description="Event-loop lag (ms) above which the worker reduces its concurrency",
+    )
+
+    WORKER_TARGET_WAIT_MS: float = Field(
+        1000.0,
+        description="Queue wait time (ms) above which a saturated worker increases its concurrency",
+    )
+
+    WORKER_MAX_ERROR_RATE: float = Field(
+        0.2,
+        description="Share of failed or retried jobs above which the worker reduces its concurrency",
+    )
+
+    # Multi-process supervisor (used by `python supervisor.py`)
+    WORKER_PROCESSES: int = Field(
+        0,
+        description="Number of worker processes to run, 0 means one per CPU",
+    )
+
+    WORKER_DRAIN_TIMEOUT: int = Field(
+        60,
+        description="Seconds a worker waits for in-flight jobs to finish after SIGTERM",
+    )
+
+    # Logging
+    LOG_LEVEL: str = Field(
+        "INFO",
+        description="Root log level, e.g. DEBUG, INFO, WARNING",
+    )
+
+    LOG_FORMAT: Literal["json", "text"] = Field(
+        "json",
+        description="Write log records as JSON lines or plain text",
+    )
+
+    LOG_SAMPLE_RATES: Dict[str, float] = Field(
+        {"main": 0.01, "tasks": 0.1},
+        description='Share of INFO/DEBUG records kept per logger, as JSON, e.g. {"main": 0.01}',
+    )
+
+    # Admission control for the enqueue endpoints
+    RATE_LIMIT_PER_SECOND: float = Field(
+        10.0,
+        description="Jobs each user (or client IP) may enqueue per second on average, 0 disables the limit",
+    )
+
+    RATE_LIMIT_BURST: int = Field(
+        50,
+        description="Jobs each user (or client IP) may enqueue in a burst above the average rate",
+    )
+
+    QUEUE_HIGH_WATERMARK: int = Field(
+        10000,
+        description="Queue depth at which new jobs are rejected with 429, 0 disables the check and fair sharing",
+    )
+
+    FAIR_SHARE_MIN_JOBS: int = Field(
+        10,
+        description="Jobs every user may have queued or running, however many users share the worker slots",
+    )
+
+    ADMISSION_RETRY_AFTER: int = Field(
+        5,
+        description="Retry-After (seconds) sent when the queue is full or a user is over its fair share",
+    )
+
     # These two will be filled in by our validator
     redis_host: str
     redis_port: int
@@ -43,3 +124,10 @@ class Settings(BaseSettings):
 @lru_cache
 def get_settings() -> Settings:
     return Settings()
+
+
+@lru_cache
+def get_redis_settings() -> RedisSettings:
+    """ARQ connection settings for REDIS_BROKER, shared by the API, the worker and the supervisor."""
+    settings = get_settings()
+    return RedisSettings(host=settings.redis_host, port=settings.redis_port)
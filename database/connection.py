@@ -1,5 +1,7 @@
+from functools import lru_cache
 from pathlib import Path
 
+from sqlalchemy.engine import Engine
 from sqlmodel import Session, create_engine
 
 from config import get_settings
@@ -11,12 +13,15 @@ DATABASE_URL = f"sqlite:///{DATABASE_PATH}"
 CONNECT_ARGS = {"check_same_thread": False}
 
 
-engine = create_engine(DATABASE_URL, echo=False, connect_args=CONNECT_ARGS)
+@lru_cache
+def get_engine() -> Engine:
+    # Created on first use, so importing this module does not touch the database
+    return create_engine(DATABASE_URL, echo=False, connect_args=CONNECT_ARGS)
 
 
 def get_db():
     # Create a SQLModel Session instance directly
-    db = Session(engine)
+    db = Session(get_engine())
     try:
         yield db
     finally:
@@ -0,0 +1,25 @@
+"""database/migrate.py
+
+Creates the database schema. Run it once per deployment, before starting the API
+and the workers, instead of on every process start:
+
+    python -m database.migrate
+"""
+
+import logging
+
+from database.connection import DATABASE_URL
+from database.models import configure
+from utils.logger import setup_logging
+
+logger = logging.getLogger(__name__)
+
+
+def main() -> None:
+    setup_logging()
+    configure()
+    logger.info("Database schema is up to date", extra={"database": DATABASE_URL})
+
+
+if __name__ == "__main__":
+    main()
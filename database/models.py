@@ -7,7 +7,7 @@ from sqlalchemy import JSON as SAJson
 from sqlalchemy import Column  # For storing JSON
 from sqlmodel import Field, SQLModel
 
-from database.connection import engine
+from database.connection import get_engine
 
 
 class JobHistory(SQLModel, table=True):
@@ -44,6 +44,6 @@ class JobHistory(SQLModel, table=True):
 
 def configure():
     """
-    Create all tables.
+    Create all tables. Run through `python -m database.migrate`, not at API startup.
     """
-    SQLModel.metadata.create_all(bind=engine)
+    SQLModel.metadata.create_all(bind=get_engine())
@@ -1,26 +1,44 @@
 # app.py
 
+import logging
 from datetime import datetime
+from typing import List
+from uuid import uuid4
 
-from arq.connections import ArqRedis, RedisSettings
+from arq.connections import ArqRedis
 from arq.jobs import Job
-from fastapi import Depends, FastAPI, HTTPException
+from fastapi import Depends, FastAPI, HTTPException, Request
+from fastapi.responses import JSONResponse
 from sqlmodel import Session
 
 from config import get_settings
 from database.connection import get_db
-from models import JobEnqueueResponse, JobStatusResponse, LongCallRequest, MathRequest
+from models import (
+    ChainRequest,
+    ChordRequest,
+    GroupRequest,
+    JobEnqueueResponse,
+    JobStatusResponse,
+    LongCallRequest,
+    MathRequest,
+    WorkflowEnqueueResponse,
+    WorkflowStatusResponse,
+    WorkflowStep,
+)
 from redis_pool import get_redis_pool
 from schemas.models import JobHistoryRead  # Import for type hinting if needed, though get_job_history returns it
+from task_names import TASK_NAMES
+from utils.admission import AdmissionRejected, admission, client_identity
 from utils.events import on_shutdown, on_start_up
 from utils.job_info import process_job_info
 from utils.job_info_crud import get_job_history
+from utils.workflows import CALLBACK, get_workflow, member_job_id, start_workflow, workflow_job_ids
 
 # Configuration settings
 config = get_settings()
 
-# Configure Redis connection
-REDIS_SETTINGS = RedisSettings(host=config.redis_host, port=config.redis_port)
+# Logging is set up by `on_start_up`
+logger = logging.getLogger(__name__)
 
 # FastAPI app
 app = FastAPI(
@@ -31,42 +49,115 @@ app = FastAPI(
 )
 
 
+@app.exception_handler(AdmissionRejected)
+async def admission_rejected_handler(request: Request, exc: AdmissionRejected) -> JSONResponse:
+    return JSONResponse(status_code=429, content={"detail": exc.detail}, headers={"Retry-After": str(exc.retry_after)})
+
+
+def check_workflow_functions(steps: List[WorkflowStep]) -> None:
+    """
+    Reject steps that name a function the worker does not register: ARQ would fail such a
+    job without running the workflow hooks.
+    """
+    unknown = sorted({step.function for step in steps} - set(TASK_NAMES))
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown task function(s): {', '.join(unknown)}. Available: {', '.join(sorted(TASK_NAMES))}.")
+
+
 # FastAPI endpoints
 @app.post("/tasks/long_call", response_model=JobEnqueueResponse)
-async def enqueue_long_call(request: LongCallRequest, redis: ArqRedis = Depends(get_redis_pool)):
-    job = await redis.enqueue_job("long_call", request.url)
-    if job is None:
-        raise HTTPException(status_code=500, detail="Failed to enqueue job")
+async def enqueue_long_call(request: LongCallRequest, http_request: Request, redis: ArqRedis = Depends(get_redis_pool)):
+    job_id = uuid4().hex
+    async with admission(redis, client_identity(http_request), [job_id]):
+        job = await redis.enqueue_job("long_call", request.url, _job_id=job_id)
+        if job is None:
+            raise HTTPException(status_code=500, detail="Failed to enqueue job")
     return JobEnqueueResponse(job_id=job.job_id)
 
 
 @app.post("/tasks/add", response_model=JobEnqueueResponse)
-async def enqueue_add(request: MathRequest, redis: ArqRedis = Depends(get_redis_pool)):
-    job = await redis.enqueue_job("add", request.x, request.y, request.username)
-    if job is None:
-        raise HTTPException(status_code=500, detail="Failed to enqueue job")
+async def enqueue_add(request: MathRequest, http_request: Request, redis: ArqRedis = Depends(get_redis_pool)):
+    job_id = uuid4().hex
+    async with admission(redis, client_identity(http_request, request.username), [job_id]):
+        job = await redis.enqueue_job("add", request.x, request.y, request.username, _job_id=job_id)
+        if job is None:
+            raise HTTPException(status_code=500, detail="Failed to enqueue job")
     return JobEnqueueResponse(job_id=job.job_id)
 
 
 @app.post("/tasks/scheduled_add", response_model=JobEnqueueResponse)
-async def enqueue_scheduled_add(hour: int, min: int, request: MathRequest, redis: ArqRedis = Depends(get_redis_pool)):
+async def enqueue_scheduled_add(hour: int, min: int, request: MathRequest, http_request: Request, redis: ArqRedis = Depends(get_redis_pool)):
     """Enqueue a job to perform addition at a scheduled time."""
     target_time = datetime.now().replace(hour=hour, minute=min, second=15, microsecond=0)
 
-    job = await redis.enqueue_job("scheduled_add", request.x, request.y, request.username, _defer_until=target_time)
-    if job is None:
-        raise HTTPException(status_code=500, detail="Failed to enqueue job")
+    job_id = uuid4().hex
+    async with admission(redis, client_identity(http_request, request.username), [job_id]):
+        job = await redis.enqueue_job("scheduled_add", request.x, request.y, request.username, _job_id=job_id, _defer_until=target_time)
+        if job is None:
+            raise HTTPException(status_code=500, detail="Failed to enqueue job")
     return JobEnqueueResponse(job_id=job.job_id)
 
 
 @app.post("/tasks/divide", response_model=JobEnqueueResponse)
-async def enqueue_divide(request: MathRequest, redis: ArqRedis = Depends(get_redis_pool)):
-    job = await redis.enqueue_job("divide", request.x, request.y, request.username)
-    if job is None:
-        raise HTTPException(status_code=500, detail="Failed to enqueue job")
+async def enqueue_divide(request: MathRequest, http_request: Request, redis: ArqRedis = Depends(get_redis_pool)):
+    job_id = uuid4().hex
+    async with admission(redis, client_identity(http_request, request.username), [job_id]):
+        job = await redis.enqueue_job("divide", request.x, request.y, request.username, _job_id=job_id)
+        if job is None:
+            raise HTTPException(status_code=500, detail="Failed to enqueue job")
     return JobEnqueueResponse(job_id=job.job_id)
 
 
+@app.post("/workflows/chain", response_model=WorkflowEnqueueResponse)
+async def enqueue_chain(request: ChainRequest, http_request: Request, redis: ArqRedis = Depends(get_redis_pool)):
+    """Run the steps one after another, passing each result to the next step as its first argument."""
+    check_workflow_functions(request.steps)
+    steps = [step.model_dump() for step in request.steps]
+    workflow_id = uuid4().hex
+    async with admission(redis, client_identity(http_request), workflow_job_ids(workflow_id, "chain", len(steps))):
+        workflow_id, job_ids = await start_workflow(redis, "chain", steps, workflow_id=workflow_id)
+    return WorkflowEnqueueResponse(workflow_id=workflow_id, job_ids=job_ids)
+
+
+@app.post("/workflows/group", response_model=WorkflowEnqueueResponse)
+async def enqueue_group(request: GroupRequest, http_request: Request, redis: ArqRedis = Depends(get_redis_pool)):
+    """Enqueue all jobs at once and track them as one workflow."""
+    check_workflow_functions(request.jobs)
+    jobs = [job.model_dump() for job in request.jobs]
+    workflow_id = uuid4().hex
+    async with admission(redis, client_identity(http_request), workflow_job_ids(workflow_id, "group", len(jobs))):
+        workflow_id, job_ids = await start_workflow(redis, "group", jobs, workflow_id=workflow_id)
+    return WorkflowEnqueueResponse(workflow_id=workflow_id, job_ids=job_ids)
+
+
+@app.post("/workflows/chord", response_model=WorkflowEnqueueResponse)
+async def enqueue_chord(request: ChordRequest, http_request: Request, redis: ArqRedis = Depends(get_redis_pool)):
+    """Enqueue all jobs at once and run the callback with the list of their results once they all succeed."""
+    check_workflow_functions([*request.jobs, request.callback])
+    jobs = [job.model_dump() for job in request.jobs]
+    workflow_id = uuid4().hex
+    async with admission(redis, client_identity(http_request), workflow_job_ids(workflow_id, "chord", len(jobs))):
+        workflow_id, job_ids = await start_workflow(redis, "chord", jobs, callback=request.callback.model_dump(), workflow_id=workflow_id)
+    return WorkflowEnqueueResponse(workflow_id=workflow_id, job_ids=job_ids, callback_job_id=member_job_id(workflow_id, CALLBACK))
+
+
+@app.get("/workflows/{workflow_id}", response_model=WorkflowStatusResponse)
+async def get_workflow_status(workflow_id: str, redis: ArqRedis = Depends(get_redis_pool)) -> WorkflowStatusResponse:
+    """
+    Retrieve the progress of a workflow. Results of the individual jobs are available
+    from `/jobs/{job_id}` using the returned job ids.
+
+    Workflow status values:
+        - running: Jobs are still queued or in progress.
+        - complete: Every job (and the chord callback) succeeded.
+        - failed: A chain step, group member, chord member or chord callback failed.
+    """
+    workflow = await get_workflow(redis, workflow_id)
+    if workflow is None:
+        raise HTTPException(status_code=404, detail=f"Workflow ID '{workflow_id}' was not found.")
+    return WorkflowStatusResponse(**workflow)
+
+
 @app.get("/jobs/{job_id}", response_model=JobStatusResponse)
 async def get_job_status(job_id: str, db: Session = Depends(get_db), redis: ArqRedis = Depends(get_redis_pool)) -> JobStatusResponse:
     """
@@ -102,7 +193,7 @@ async def get_job_status(job_id: str, db: Session = Depends(get_db), redis: ArqR
 
     if job_info_from_redis:
         # If found in Redis, return that information
-        print(f"Job {job_id} found in Redis")
+        logger.info("Job found in Redis", extra={"job_id": job_id})
         # process_job_info already returns JobStatusResponse
         return job_info_from_redis
     else:
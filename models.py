@@ -1,8 +1,8 @@
 # models.py
 
-from typing import Optional
+from typing import Any, Dict, List, Optional
 
-from pydantic import BaseModel, HttpUrl
+from pydantic import BaseModel, Field, HttpUrl, field_validator
 
 
 # Pydantic models for request validation
@@ -28,9 +28,63 @@ class JobStatusResponse(BaseModel):
     args: Optional[str] = None
     error: Optional[str] = None
     attempts: Optional[int] = 0
+    progress: Optional[float] = None
+    progress_message: Optional[str] = None
 
 
 class JobEnqueueResponse(BaseModel):
     job_id: str
     message: str = "Job successfully queued."
     success: Optional[bool] = True
+
+
+# Workflow models
+class WorkflowStep(BaseModel):
+    function: str
+    args: List[Any] = []
+    kwargs: Dict[str, Any] = {}
+
+    # The kwargs are passed to `enqueue_job`, where names starting with "_" are ARQ's own
+    # options (_job_id, _queue_name, _defer_by, ...), not arguments of the function
+    @field_validator("kwargs")
+    @classmethod
+    def _reject_arq_options(cls, kwargs: Dict[str, Any]) -> Dict[str, Any]:
+        reserved = sorted(name for name in kwargs if name.startswith("_"))
+        if reserved:
+            raise ValueError(f"keyword arguments must not start with '_': {', '.join(reserved)}")
+        return kwargs
+
+
+class ChainRequest(BaseModel):
+    steps: List[WorkflowStep] = Field(..., min_length=1)
+
+
+class GroupRequest(BaseModel):
+    jobs: List[WorkflowStep] = Field(..., min_length=1)
+
+
+class ChordRequest(BaseModel):
+    jobs: List[WorkflowStep] = Field(..., min_length=1)
+    callback: WorkflowStep
+
+
+class WorkflowEnqueueResponse(BaseModel):
+    workflow_id: str
+    job_ids: List[str]
+    callback_job_id: Optional[str] = None
+    message: str = "Workflow successfully queued."
+    success: Optional[bool] = True
+
+
+class WorkflowStatusResponse(BaseModel):
+    workflow_id: str
+    kind: str
+    status: str
+    total: int
+    finished: int
+    succeeded: int
+    failed: int
+    job_ids: List[str]
+    callback_job_id: Optional[str] = None
+    created_at: Optional[str] = None
+    finished_at: Optional[str] = None
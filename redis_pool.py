@@ -1,34 +1,49 @@
 # redis_pool.py
 
-from typing import AsyncGenerator
+import asyncio
+from typing import AsyncGenerator, Optional
 
 from arq import create_pool
-from arq.connections import ArqRedis, RedisSettings
+from arq.connections import ArqRedis
 from fastapi import HTTPException
 from redis.exceptions import ConnectionError as RedisConnectionError
 from redis.exceptions import TimeoutError as RedisTimeoutError
 
-from config import get_settings
+from config import get_redis_settings, get_settings
 
 # Configuration settings
 config = get_settings()
 
-# Configure Redis connection
-REDIS_SETTINGS = RedisSettings(host=config.redis_host, port=config.redis_port)
+# One pool per process, created by the first request that needs it
+_pool: Optional[ArqRedis] = None
+_pool_lock = asyncio.Lock()
+
+
+async def open_redis_pool() -> ArqRedis:
+    """
+    Return the process-wide ARQ Redis pool, connecting on first use.
+    """
+    global _pool
+    if _pool is None:
+        async with _pool_lock:
+            if _pool is None:
+                _pool = await create_pool(get_redis_settings(), default_queue_name=config.WORKER_QUEUE)
+    return _pool
+
+
+async def close_redis_pool() -> None:
+    global _pool
+    if _pool is not None:
+        await _pool.close()
+        _pool = None
 
 
 # Dependency to provide Redis pool
 async def get_redis_pool() -> AsyncGenerator[ArqRedis, None]:
     try:
-        redis = await create_pool(
-            REDIS_SETTINGS,
-            default_queue_name=config.WORKER_QUEUE,
-        )
+        redis = await open_redis_pool()
     except (RedisTimeoutError, RedisConnectionError) as exc:
         # You can log.exc_info() here if you like, or do retry logic
         raise HTTPException(status_code=503, detail="Could not connect to Redis - please try again later.") from exc
 
-    try:
-        yield redis
-    finally:
-        await redis.close()
+    yield redis
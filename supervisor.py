@@ -0,0 +1,247 @@
+# supervisor.py
+
+import json
+import logging
+import multiprocessing
+import os
+import signal
+import socket
+import sys
+import time
+from typing import Any, Dict, List, Optional
+
+from redis import Redis
+from redis.exceptions import RedisError
+
+# Imported before forking so every child starts with the worker, task and database
+# modules already loaded (copy-on-write) instead of importing them again.
+import worker
+from config import get_settings
+from utils.logger import setup_logging, stop_logging
+
+# Configuration settings
+config = get_settings()
+
+logger = logging.getLogger("supervisor")
+
+HOSTNAME = socket.gethostname()
+
+# Restart backoff: 1s, 2s, 4s ... capped at 60s; reset once a child stays up for a minute
+RESTART_BACKOFF_BASE = 1.0
+RESTART_BACKOFF_MAX = 60.0
+RESTART_STABLE_AFTER = 60.0
+
+# How often children record their health and the supervisor aggregates it (seconds)
+REPORT_INTERVAL = 10
+
+
+def child_health_check_key(pid: int) -> str:
+    return f"{config.WORKER_QUEUE}:health-check:{HOSTNAME}:{pid}"
+
+
+def child_concurrency_key(pid: int) -> str:
+    return f"{config.WORKER_QUEUE}:concurrency:{HOSTNAME}:{pid}"
+
+
+def supervisor_key() -> str:
+    return f"{config.WORKER_QUEUE}:supervisor:{HOSTNAME}"
+
+
+def run_child(drain_timeout: int) -> None:
+    """
+    Entry point of a worker process.
+
+    SIGTERM makes ARQ stop picking new jobs and wait up to `drain_timeout` seconds
+    for in-flight jobs before shutting down.
+    """
+    # Drop the handlers inherited from the supervisor; ARQ installs its own on the event loop
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+
+    # The log listener thread does not survive the fork
+    setup_logging(force=True)
+
+    try:
+        worker.run_worker(
+            job_completion_wait=drain_timeout,
+            health_check_key=child_health_check_key(os.getpid()),
+            health_check_interval=REPORT_INTERVAL,
+        )
+    finally:
+        # multiprocessing ends the child with os._exit, which skips atexit: flush the
+        # queued records (the drain and shutdown lines) before the process goes away
+        stop_logging()
+
+
+class ChildSlot:
+    """One supervised worker process and its restart state."""
+
+    def __init__(self, index: int):
+        self.index = index
+        self.process: Optional[multiprocessing.Process] = None
+        self.started_at = 0.0
+        self.restarts = 0
+        self.failures = 0
+        self.next_start = 0.0
+        self.last_exitcode: Optional[int] = None
+
+    @property
+    def alive(self) -> bool:
+        return self.process is not None and self.process.is_alive()
+
+
+class Supervisor:
+    """
+    Runs `processes` ARQ workers on the same queue, restarts crashed ones with exponential
+    backoff, forwards SIGTERM/SIGINT for a graceful drain and aggregates the health and
+    concurrency metrics of every child as JSON under the Redis key `{queue}:supervisor:{host}`.
+    """
+
+    def __init__(self, processes: int, drain_timeout: int):
+        self.drain_timeout = drain_timeout
+        self.slots = [ChildSlot(index) for index in range(processes)]
+        self.stopping = False
+        self.redis = Redis(host=config.redis_host, port=config.redis_port, decode_responses=True)
+        # fork shares the modules imported above; fall back to spawn where it is unavailable
+        method = "fork" if "fork" in multiprocessing.get_all_start_methods() else "spawn"
+        self.mp = multiprocessing.get_context(method)
+
+    def _start(self, slot: ChildSlot) -> None:
+        slot.process = self.mp.Process(target=run_child, args=(self.drain_timeout,), name=f"arq-worker-{slot.index}")
+        slot.process.start()
+        slot.started_at = time.monotonic()
+        logger.info("Started worker %d (pid %d)", slot.index, slot.process.pid)
+
+    def _handle_exit(self, slot: ChildSlot) -> None:
+        slot.last_exitcode = slot.process.exitcode
+        uptime = time.monotonic() - slot.started_at
+        slot.failures = 0 if uptime >= RESTART_STABLE_AFTER else slot.failures + 1
+        backoff = 0.0 if slot.failures == 0 else min(RESTART_BACKOFF_MAX, RESTART_BACKOFF_BASE * 2 ** (slot.failures - 1))
+        slot.next_start = time.monotonic() + backoff
+        slot.restarts += 1
+        slot.process = None
+        logger.warning("Worker %d exited with code %s after %.1fs, restarting in %.1fs", slot.index, slot.last_exitcode, uptime, backoff)
+
+    def _handle_signal(self, signum, frame) -> None:
+        if not self.stopping:
+            logger.info("Received %s, draining workers", signal.Signals(signum).name)
+        self.stopping = True
+
+    def collect(self) -> Dict[str, Any]:
+        """
+        Read the health-check string and concurrency hash of every child from Redis.
+        """
+        children: List[Dict[str, Any]] = []
+        pids = [slot.process.pid if slot.alive else None for slot in self.slots]
+
+        with self.redis.pipeline(transaction=False) as pipe:
+            for pid in pids:
+                if pid is not None:
+                    pipe.get(child_health_check_key(pid))
+                    pipe.hgetall(child_concurrency_key(pid))
+            replies = iter(pipe.execute())
+
+        for slot, pid in zip(self.slots, pids):
+            health, concurrency = (next(replies), next(replies)) if pid is not None else (None, {})
+            children.append(
+                {
+                    "index": slot.index,
+                    "pid": pid,
+                    "alive": pid is not None,
+                    "uptime_s": round(time.monotonic() - slot.started_at, 1) if pid is not None else 0,
+                    "restarts": slot.restarts,
+                    "last_exitcode": slot.last_exitcode,
+                    "health": health,
+                    "concurrency": concurrency,
+                }
+            )
+
+        return {
+            "host": HOSTNAME,
+            "queue": config.WORKER_QUEUE,
+            "processes": len(self.slots),
+            "alive": sum(child["alive"] for child in children),
+            "restarts": sum(child["restarts"] for child in children),
+            "limit": sum(int(child["concurrency"].get("limit", 0)) for child in children),
+            "in_flight": sum(int(child["concurrency"].get("in_flight", 0)) for child in children),
+            "children": children,
+            "updated_at": int(time.time() * 1000),
+        }
+
+    def report(self) -> None:
+        try:
+            summary = self.collect()
+            self.redis.set(supervisor_key(), json.dumps(summary), px=REPORT_INTERVAL * 3000)
+        except RedisError as exc:
+            logger.warning("Could not report worker health: %r", exc)
+            return
+        logger.info(
+            "Workers alive=%d/%d restarts=%d limit=%d in_flight=%d",
+            summary["alive"],
+            summary["processes"],
+            summary["restarts"],
+            summary["limit"],
+            summary["in_flight"],
+        )
+
+    def drain(self) -> None:
+        """
+        Forward SIGTERM to every child and wait for them to finish their in-flight jobs,
+        killing any that are still running after the drain timeout.
+        """
+        for slot in self.slots:
+            if slot.alive:
+                os.kill(slot.process.pid, signal.SIGTERM)
+
+        # ARQ needs a moment after the drain timeout to run its shutdown hooks
+        deadline = time.monotonic() + self.drain_timeout + 10
+        for slot in self.slots:
+            if slot.process is None:
+                continue
+            slot.process.join(max(0.0, deadline - time.monotonic()))
+            if slot.process.is_alive():
+                logger.warning("Worker %d (pid %d) did not drain in time, killing it", slot.index, slot.process.pid)
+                slot.process.kill()
+                slot.process.join()
+
+    def run(self) -> None:
+        signal.signal(signal.SIGTERM, self._handle_signal)
+        signal.signal(signal.SIGINT, self._handle_signal)
+
+        for slot in self.slots:
+            self._start(slot)
+
+        next_report = time.monotonic() + REPORT_INTERVAL
+        try:
+            while not self.stopping:
+                now = time.monotonic()
+                for slot in self.slots:
+                    if slot.process is not None and not slot.process.is_alive():
+                        self._handle_exit(slot)
+                    if slot.process is None and now >= slot.next_start:
+                        self._start(slot)
+
+                if now >= next_report:
+                    next_report = now + REPORT_INTERVAL
+                    self.report()
+
+                time.sleep(0.5)
+        finally:
+            self.drain()
+            try:
+                self.redis.delete(supervisor_key())
+            except RedisError:
+                pass
+            self.redis.close()
+            logger.info("All workers stopped")
+
+
+def main() -> int:
+    setup_logging()
+    processes = config.WORKER_PROCESSES or os.cpu_count() or 1
+    Supervisor(processes=processes, drain_timeout=config.WORKER_DRAIN_TIMEOUT).run()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,5 @@
+# task_names.py
+
+# Names of the ARQ functions the worker registers. The API checks workflow steps against
+# this list without importing the task code (and its HTTP client) itself.
+TASK_NAMES = ("long_call", "add", "divide", "scheduled_add", "sum_results")
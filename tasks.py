@@ -2,117 +2,140 @@ import asyncio
 import logging
 from typing import Optional
 
+from arq.worker import Retry
 from httpx import AsyncClient, HTTPStatusError, RequestError
 
+from utils.logger import log_job_context
+from utils.progress import report_progress
+
+logger = logging.getLogger(__name__)
+
+# Seconds before long_call tries again, multiplied by the number of tries so far
+LONG_CALL_RETRY_DELAY_S = 5
+
 
 # ARQ task definitions
-async def long_call(ctx, url: str, task_id: str, max_tries: int = 3):
+@log_job_context
+async def long_call(ctx, url: str, max_tries: int = 3):
     """
     Task to perform an HTTP GET request with retries.
     Stores progress and results in Redis.
     """
-    redis = ctx["redis"]
     session: AsyncClient = ctx["session"]
-    tries = ctx.get("tries", 1)
-
-    # Update task state in Redis
-    await redis.hset(
-        f"task:{task_id}",
-        mapping={
-            "status": "PROGRESS",
-            "url": url,
-            "tries": str(tries),
-            "max_tries": str(max_tries),
-        },
-    )
+    tries = ctx["job_try"]
+
+    # Update progress
+    await report_progress(ctx, 0, f"Requesting {url} (try {tries} of {max_tries})")
 
     try:
         response = await session.get(url, timeout=180)  # 3 minutes
         response.raise_for_status()
         result = response.json()
 
-        # Store result in Redis
-        await redis.hset(f"task:{task_id}", mapping={"status": "SUCCESS", "result": str(result)})
+        await report_progress(ctx, 100, "Request completed")
         return result
     except RequestError as exc:
-        logging.error(f"Request error for {url}: {exc}")
+        logger.error("Request error for %s: %s", url, exc)
         if tries >= max_tries:
-            await redis.hset(
-                f"task:{task_id}",
-                mapping={
-                    "status": "FAILURE",
-                    "error": f"Max retries exceeded: {str(exc)}",
-                },
-            )
+            await report_progress(ctx, 0, f"Max retries exceeded: {str(exc)}")
             raise
-        # Re-enqueue with incremented tries
-        await redis.enqueue_job("long_call", url, task_id, max_tries, _tries=tries + 1)
-        raise
+        # Let ARQ run the same job again, backing off a little more after each try
+        defer = LONG_CALL_RETRY_DELAY_S * tries
+        await report_progress(ctx, 0, f"Request failed, retrying in {defer}s: {str(exc)}")
+        raise Retry(defer=defer) from exc
     except HTTPStatusError as exc:
-        logging.error(f"HTTP status error for {url}: {exc}")
-        await redis.hset(f"task:{task_id}", mapping={"status": "FAILURE", "error": str(exc)})
+        logger.error("HTTP status error for %s: %s", url, exc)
+        await report_progress(ctx, 0, f"Request failed: {str(exc)}")
         raise
 
 
+@log_job_context
 async def add(ctx, x: float, y: float, username: Optional[str] = None):
     """
     Task to perform addition with simulated long-running steps.
     Stores progress and results in Redis.
     """
 
-    print("Step 1: Starting addition")
+    logger.info("Step 1: Starting addition")
+    await report_progress(ctx, 0, "Starting addition")
     await asyncio.sleep(15)
 
     result = x + y
 
     # Update progress
-    print("Step 2: Finished addition")
+    logger.info("Step 2: Finished addition")
+    await report_progress(ctx, 40, "Finished addition")
     await asyncio.sleep(15)
 
     # Update progress
-
-    print("Step 3: Returning result")
+    logger.info("Step 3: Returning result")
+    await report_progress(ctx, 80, "Returning result")
     await asyncio.sleep(10)
 
-    print(f"Result: {result}")
+    logger.info("Result: %s", result)
+    await report_progress(ctx, 100, "Done")
     return {"result": result, "username": username}
 
 
+@log_job_context
 async def scheduled_add(ctx, x: float, y: float, username: Optional[str] = None):
     """
     Task to perform addition with simulated long-running steps.
     Stores progress and results in Redis.
     """
 
-    print("Step 1: Starting addition")
+    logger.info("Step 1: Starting addition")
+    await report_progress(ctx, 0, "Starting addition")
     await asyncio.sleep(15)
 
     result = x + y
 
     # Update progress
-    print("Step 2: Finished addition")
+    logger.info("Step 2: Finished addition")
+    await report_progress(ctx, 40, "Finished addition")
     await asyncio.sleep(15)
 
     # Update progress
-
-    print("Step 3: Returning result")
+    logger.info("Step 3: Returning result")
+    await report_progress(ctx, 80, "Returning result")
     await asyncio.sleep(10)
 
-    print(f"Result: {result}")
+    logger.info("Result: %s", result)
+    await report_progress(ctx, 100, "Done")
     return {"result": result, "username": username}
 
 
+@log_job_context
 async def divide(ctx, x: float, y: float, username: Optional[str] = None):
     """
     Task to perform division with retries.
     Stores progress and results in Redis.
     """
-    print("Step 1: Starting division")
+    logger.info("Step 1: Starting division")
     try:
         result = x / y
 
         return {"result": result, "username": username}
     except Exception as exc:
-        logging.error(f"Error in divide: {exc!r}")
+        logger.error("Error in divide: %r", exc)
         # Let ARQ handle retries by raising the exception
         raise
+
+
+@log_job_context
+async def sum_results(ctx, results, username: Optional[str] = None):
+    """
+    Task to add up the results of other jobs, e.g. as a chord callback or chain step.
+    Accepts a single result or a list of them; dict results contribute their "result" value.
+    """
+    if not isinstance(results, list):
+        results = [results]
+
+    total = 0.0
+    for item in results:
+        value = item.get("result") if isinstance(item, dict) else item
+        if isinstance(value, (int, float)):
+            total += value
+
+    return {"result": total, "count": len(results), "username": username}
+
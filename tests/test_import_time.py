@@ -0,0 +1,15 @@
+"""tests/test_import_time.py
+
+Keeps the API and worker start-up within the budgets of benchmarks/import_time.py.
+"""
+
+import pytest
+
+from benchmarks.import_time import DEFAULT_BUDGETS_MS, measure
+
+
+@pytest.mark.parametrize("module", sorted(DEFAULT_BUDGETS_MS))
+def test_import_time_within_budget(module: str):
+    total, slowest = measure(module, runs=5)
+    top = ", ".join(f"{name} {ms:.0f} ms" for name, ms in slowest[:5])
+    assert total <= DEFAULT_BUDGETS_MS[module], f"import {module} took {total:.0f} ms, budget {DEFAULT_BUDGETS_MS[module]:.0f} ms (slowest: {top})"
@@ -0,0 +1,381 @@
+"""utils/admission.py
+
+Admission control for the enqueue endpoints, decided in a single Lua round trip:
+
+    1. queue depth: reject when the queue would hold more than QUEUE_HIGH_WATERMARK jobs;
+    2. rate limit: a token bucket per identity (username, or client IP when there is none)
+       refilled at RATE_LIMIT_PER_SECOND up to RATE_LIMIT_BURST tokens;
+    3. fair share: an identity may have at most max(FAIR_SHARE_MIN_JOBS, worker slots / active
+       identities) jobs queued or running. ARQ runs jobs in queue order, so the share is taken
+       from the job slots of the live workers rather than from the queue: a heavy user can then
+       never have more jobs ahead of a newcomer than the workers can run at once. Each worker
+       advertises its current slot count (`register_worker`); with no live worker the share
+       falls back to watermark / active identities.
+
+Fair sharing is enforced here rather than by deferring jobs when they start: ARQ calls
+`on_job_start` outside its retry handling, so a hook cannot send a job back to the queue.
+
+Every admitted job id (including each workflow member) is added to a sorted set per identity,
+scored by admission time, and to an owner hash (job_id -> identity). The size of the set is the
+identity's outstanding job count. Slots are given back:
+
+    - by the worker's `after_job_end` hook (`release_admission`) once the job has a result;
+    - by `admission` when the enqueue itself fails;
+    - by `reconcile_identity`, which checks the identity's older entries against ARQ's result
+      and job keys. It covers jobs ARQ finishes without calling `after_job_end` (max tries
+      exceeded, expired, aborted or unknown function) and workflow members that will never
+      run. It runs when an identity hits its fair share and periodically from the worker
+      (`run_admission_sweeper`, which also sends the worker's slot count).
+
+The worker imports this module too, so it stays free of FastAPI: `admit` raises
+`AdmissionRejected`, which the API turns into a 429 response.
+"""
+
+import asyncio
+import logging
+import math
+import time
+from contextlib import asynccontextmanager
+from typing import TYPE_CHECKING, AsyncIterator, Callable, Optional, Sequence, Tuple
+
+from arq.connections import ArqRedis
+from arq.constants import in_progress_key_prefix, job_key_prefix, result_key_prefix
+from arq.utils import timestamp_ms
+from redis.commands.core import AsyncScript
+
+from config import get_settings
+from utils.workflows import parse_member_job_id, workflow_key
+
+if TYPE_CHECKING:
+    from fastapi import Request
+
+logger = logging.getLogger(__name__)
+
+RATE_LIMIT_KEY_PREFIX = "arq:ratelimit:"
+JOBS_KEY_PREFIX = "arq:admission:jobs:"
+ACTIVE_KEY = "arq:admission:active"
+OWNER_KEY = "arq:admission:owner"
+# Live workers (scored by when their registration expires) and their job slots
+WORKERS_KEY = "arq:admission:workers"
+SLOTS_KEY = "arq:admission:slots"
+
+# An identity counts as active for fair sharing if it enqueued something this recently
+ACTIVE_WINDOW_MS = 60_000
+ACTIVE_TTL_S = 3600
+# Entries younger than this are left alone by reconciliation: the job may not be enqueued yet
+RECONCILE_GRACE_MS = 60_000
+# How often each worker reconciles all identities (seconds)
+SWEEP_INTERVAL_S = 60
+# How often each worker sends its slot count (seconds); it is forgotten after three missed beats
+HEARTBEAT_INTERVAL_S = 10
+WORKER_TTL_MS = 3 * HEARTBEAT_INTERVAL_S * 1000
+
+ADMIT_SCRIPT = """
+local now = tonumber(ARGV[1])
+local rate = tonumber(ARGV[2])
+local capacity = tonumber(ARGV[3])
+local watermark = tonumber(ARGV[4])
+local min_share = tonumber(ARGV[5])
+local window = tonumber(ARGV[6])
+local identity = ARGV[7]
+local active_ttl = tonumber(ARGV[8])
+local first_job = 9
+local cost = #ARGV - first_job + 1
+
+-- 1. global queue depth
+if watermark > 0 and redis.call('ZCARD', KEYS[2]) + cost > watermark then
+    return {0, 0, 'queue_full'}
+end
+
+-- 2. token bucket (a rate of 0 disables it)
+local tokens = 0
+if rate > 0 then
+    local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+    tokens = tonumber(bucket[1]) or capacity
+    local ts = tonumber(bucket[2]) or now
+    tokens = math.min(capacity, tokens + math.max(0, now - ts) * rate / 1000)
+    if tokens < cost then
+        return {0, math.ceil((cost - tokens) * 1000 / rate), 'rate_limited'}
+    end
+end
+
+-- 3. fair share of the worker slots between active identities
+if watermark > 0 then
+    redis.call('ZREMRANGEBYSCORE', KEYS[4], '-inf', now - window)
+    local active = redis.call('ZCARD', KEYS[4])
+    if not redis.call('ZSCORE', KEYS[4], identity) then
+        active = active + 1
+    end
+    local gone = redis.call('ZRANGEBYSCORE', KEYS[6], '-inf', now)
+    if #gone > 0 then
+        redis.call('ZREM', KEYS[6], unpack(gone))
+        redis.call('HDEL', KEYS[7], unpack(gone))
+    end
+    local slots = 0
+    local workers = redis.call('ZRANGE', KEYS[6], 0, -1)
+    if #workers > 0 then
+        for _, n in ipairs(redis.call('HMGET', KEYS[7], unpack(workers))) do
+            slots = slots + (tonumber(n) or 0)
+        end
+    end
+    -- Without a live worker nothing runs, so share the queue instead
+    if slots == 0 then
+        slots = watermark
+    end
+    local share = math.max(min_share, math.floor(slots / active))
+    if redis.call('ZCARD', KEYS[3]) + cost > share then
+        return {0, 0, 'fair_share'}
+    end
+end
+
+-- admit
+if rate > 0 then
+    redis.call('HSET', KEYS[1], 'tokens', tostring(tokens - cost), 'ts', now)
+    -- An untouched bucket is full again after capacity / rate seconds, so it can go
+    redis.call('PEXPIRE', KEYS[1], math.ceil(capacity * 1000 / rate) + 1000)
+end
+if watermark > 0 then
+    redis.call('ZADD', KEYS[4], now, identity)
+    redis.call('EXPIRE', KEYS[4], active_ttl)
+    for i = first_job, #ARGV do
+        redis.call('ZADD', KEYS[3], now, ARGV[i])
+        redis.call('HSET', KEYS[5], ARGV[i], identity)
+    end
+end
+return {1, 0, 'ok'}
+"""
+
+# ARGV: jobs key prefix, result key prefix ('' to release unconditionally), job ids...
+RELEASE_SCRIPT = """
+local released = 0
+for i = 3, #ARGV do
+    local job_id = ARGV[i]
+    if ARGV[2] == '' or redis.call('EXISTS', ARGV[2] .. job_id) == 1 then
+        local identity = redis.call('HGET', KEYS[1], job_id)
+        if identity then
+            redis.call('HDEL', KEYS[1], job_id)
+            redis.call('ZREM', ARGV[1] .. identity, job_id)
+            released = released + 1
+        end
+    end
+end
+return released
+"""
+
+REJECTION_DETAILS = {
+    "queue_full": "The job queue is full - please try again later.",
+    "rate_limited": "Too many jobs enqueued - please slow down.",
+    "fair_share": "Too many of your jobs are already queued or running - please wait for some to finish.",
+}
+
+_admit_script: Optional[AsyncScript] = None
+_release_script: Optional[AsyncScript] = None
+
+
+class AdmissionRejected(Exception):
+    """Raised by `admit`; the API answers it with 429 and a Retry-After header."""
+
+    def __init__(self, reason: str, retry_after: int):
+        self.reason = reason
+        self.retry_after = retry_after
+        self.detail = REJECTION_DETAILS.get(reason, reason)
+        super().__init__(self.detail)
+
+
+def client_identity(request: "Request", username: Optional[str] = None) -> str:
+    """
+    The identity limits are applied to: the username if one was given, else the client IP.
+    """
+    if username:
+        return f"user:{username}"
+    return f"ip:{request.client.host if request.client else 'unknown'}"
+
+
+async def _try_admit(redis: ArqRedis, identity: str, job_ids: Sequence[str]) -> Tuple[int, int, str]:
+    global _admit_script
+    if _admit_script is None:
+        _admit_script = redis.register_script(ADMIT_SCRIPT)
+
+    config = get_settings()
+    allowed, retry_after_ms, reason = await _admit_script(
+        keys=[RATE_LIMIT_KEY_PREFIX + identity, redis.default_queue_name, JOBS_KEY_PREFIX + identity, ACTIVE_KEY, OWNER_KEY, WORKERS_KEY, SLOTS_KEY],
+        args=[
+            timestamp_ms(),
+            config.RATE_LIMIT_PER_SECOND,
+            config.RATE_LIMIT_BURST,
+            config.QUEUE_HIGH_WATERMARK,
+            config.FAIR_SHARE_MIN_JOBS,
+            ACTIVE_WINDOW_MS,
+            identity,
+            ACTIVE_TTL_S,
+            *job_ids,
+        ],
+        client=redis,
+    )
+    return allowed, retry_after_ms, reason.decode() if isinstance(reason, bytes) else reason
+
+
+async def admit(redis: ArqRedis, identity: str, job_ids: Sequence[str]) -> None:
+    """
+    Admit the jobs `job_ids` for `identity` or raise `AdmissionRejected`.
+
+    Args:
+        redis (ArqRedis): ARQ Redis connection.
+        identity (str): Result of `client_identity`.
+        job_ids (Sequence[str]): Ids the jobs will be enqueued with, e.g. every member of
+                                 a workflow. Each one costs a token and a fair-share slot.
+
+    Raises:
+        AdmissionRejected: If the queue is full, the identity is rate limited or over its fair share.
+    """
+    if not job_ids:
+        raise ValueError("Nothing to admit")
+
+    allowed, retry_after_ms, reason = await _try_admit(redis, identity, job_ids)
+    if not allowed and reason == "fair_share" and await reconcile_identity(redis, identity):
+        # Some of the slots belonged to jobs that ended without `after_job_end`
+        allowed, retry_after_ms, reason = await _try_admit(redis, identity, job_ids)
+    if allowed:
+        return
+
+    retry_after = max(1, math.ceil(retry_after_ms / 1000)) if retry_after_ms else get_settings().ADMISSION_RETRY_AFTER
+    raise AdmissionRejected(reason, retry_after)
+
+
+@asynccontextmanager
+async def admission(redis: ArqRedis, identity: str, job_ids: Sequence[str]) -> AsyncIterator[None]:
+    """
+    Admit `job_ids` for the duration of the block that enqueues them. If the block
+    raises (e.g. the enqueue failed), the slots are given back.
+    """
+    await admit(redis, identity, job_ids)
+    try:
+        yield
+    except BaseException:
+        await release_jobs(redis, job_ids)
+        raise
+
+
+async def release_jobs(redis: ArqRedis, job_ids: Sequence[str], only_finished: bool = False) -> int:
+    """
+    Give back the fair-share slots of `job_ids`.
+
+    Args:
+        redis (ArqRedis): ARQ Redis connection.
+        job_ids (Sequence[str]): Jobs to release; ids that hold no slot are ignored.
+        only_finished (bool): Only release jobs that have a result.
+
+    Returns:
+        int: The number of slots released.
+    """
+    global _release_script
+    if not job_ids:
+        return 0
+    if _release_script is None:
+        _release_script = redis.register_script(RELEASE_SCRIPT)
+    return await _release_script(
+        keys=[OWNER_KEY],
+        args=[JOBS_KEY_PREFIX, result_key_prefix if only_finished else "", *job_ids],
+        client=redis,
+    )
+
+
+async def release_admission(ctx: dict) -> None:
+    """
+    ARQ `after_job_end` hook: returns the job's fair-share slot once it has a result.
+    Runs after every try, but only releases on the last one (when the result exists).
+    """
+    await release_jobs(ctx["redis"], [ctx["job_id"]], only_finished=True)
+
+
+async def reconcile_identity(redis: ArqRedis, identity: str) -> int:
+    """
+    Release the slots of `identity` whose jobs are over without having been released:
+    the job has a result, or it is neither queued nor running (and, for a workflow member,
+    the workflow is no longer running, so it will not be enqueued later either).
+
+    Returns:
+        int: The number of slots released.
+    """
+    job_ids = [job_id.decode() for job_id in await redis.zrangebyscore(JOBS_KEY_PREFIX + identity, "-inf", timestamp_ms() - RECONCILE_GRACE_MS)]
+    if not job_ids:
+        return 0
+
+    async with redis.pipeline(transaction=False) as pipe:
+        for job_id in job_ids:
+            pipe.exists(result_key_prefix + job_id)
+            pipe.exists(job_key_prefix + job_id, in_progress_key_prefix + job_id)
+        replies = await pipe.execute()
+
+    finished, not_enqueued = [], []
+    for job_id, has_result, queued_or_running in zip(job_ids, replies[::2], replies[1::2]):
+        if has_result:
+            finished.append(job_id)
+        elif not queued_or_running:
+            not_enqueued.append(job_id)
+
+    # A job that is neither queued nor running and has no result is over (or was never
+    # enqueued), unless it is a later chain step or chord callback of a running workflow
+    members = {job_id: parse_member_job_id(job_id) for job_id in not_enqueued}
+    workflow_ids = sorted({member[0] for member in members.values() if member})
+    running = set()
+    if workflow_ids:
+        async with redis.pipeline(transaction=False) as pipe:
+            for workflow_id in workflow_ids:
+                pipe.hget(workflow_key(workflow_id), "status")
+            running = {workflow_id for workflow_id, status in zip(workflow_ids, await pipe.execute()) if status == b"running"}
+    finished.extend(job_id for job_id, member in members.items() if not member or member[0] not in running)
+
+    released = await release_jobs(redis, finished)
+    if released:
+        logger.info("Released stale admission slots", extra={"identity": identity, "released": released})
+    return released
+
+
+async def sweep_admissions(redis: ArqRedis) -> int:
+    """
+    Reconcile every identity that holds slots.
+
+    Returns:
+        int: The number of slots released.
+    """
+    released = 0
+    async for key in redis.scan_iter(match=JOBS_KEY_PREFIX + "*", count=100):
+        key = key.decode() if isinstance(key, bytes) else key
+        released += await reconcile_identity(redis, key[len(JOBS_KEY_PREFIX) :])
+    return released
+
+
+async def register_worker(redis: ArqRedis, worker_id: str, slots: int) -> None:
+    """
+    Advertise that `worker_id` runs up to `slots` jobs at a time, for the next `WORKER_TTL_MS`.
+    """
+    async with redis.pipeline(transaction=True) as pipe:
+        pipe.hset(SLOTS_KEY, worker_id, slots)
+        pipe.zadd(WORKERS_KEY, {worker_id: timestamp_ms() + WORKER_TTL_MS})
+        await pipe.execute()
+
+
+async def unregister_worker(redis: ArqRedis, worker_id: str) -> None:
+    async with redis.pipeline(transaction=True) as pipe:
+        pipe.zrem(WORKERS_KEY, worker_id)
+        pipe.hdel(SLOTS_KEY, worker_id)
+        await pipe.execute()
+
+
+async def run_admission_sweeper(redis: ArqRedis, worker_id: str, slots: Callable[[], int], interval: float = SWEEP_INTERVAL_S) -> None:
+    """
+    Until cancelled, send the worker's current slot count every `HEARTBEAT_INTERVAL_S` seconds
+    and run `sweep_admissions` every `interval` seconds. Started by the worker; with several
+    workers each one sweeps, which is harmless since releasing is idempotent.
+    """
+    last_sweep = time.monotonic()
+    while True:
+        try:
+            await register_worker(redis, worker_id, slots())
+            if time.monotonic() - last_sweep >= interval:
+                last_sweep = time.monotonic()
+                await sweep_admissions(redis)
+        except Exception:
+            logger.exception("Admission sweep failed")
+        await asyncio.sleep(HEARTBEAT_INTERVAL_S)
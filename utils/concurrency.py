@@ -0,0 +1,184 @@
+"""utils/concurrency.py"""
+
+import asyncio
+import logging
+import os
+import socket
+import time
+from typing import Any, Dict, Optional
+
+from arq.utils import timestamp_ms
+from arq.worker import Worker
+
+logger = logging.getLogger(__name__)
+
+
+class AdaptiveConcurrencyController:
+    """
+    AIMD controller for the number of jobs an ARQ worker runs at the same time.
+
+    ARQ only starts new jobs while `worker.job_counter < worker.max_jobs`, so the controller
+    works by moving `worker.max_jobs` between `min_jobs` and `max_jobs`. The worker has to be
+    created with `max_jobs` set to the upper bound, because ARQ sizes its internal semaphore
+    from the value passed to the constructor.
+
+    Every `interval` seconds the controller looks at the last window and:
+        - halves the limit (multiplicative decrease) when the event loop lagged by more than
+          `target_lag_ms` or more than `max_error_rate` of the finished jobs failed or retried;
+        - adds `increase_step` (additive increase) when the worker was saturated and jobs waited
+          in the queue for longer than `target_wait_ms`;
+        - otherwise keeps the current limit.
+
+    Its latest decision is stored in the Redis hash `{queue_name}:concurrency:{host}:{pid}`.
+    """
+
+    def __init__(
+        self,
+        worker: Worker,
+        min_jobs: int,
+        max_jobs: int,
+        initial_jobs: Optional[int] = None,
+        target_lag_ms: float = 50.0,
+        target_wait_ms: float = 1000.0,
+        max_error_rate: float = 0.2,
+        increase_step: int = 10,
+        decrease_factor: float = 0.5,
+        interval: float = 5.0,
+        tick: float = 0.1,
+        min_finished_jobs: int = 5,
+    ):
+        if not 0 < min_jobs <= max_jobs:
+            raise ValueError("min_jobs must be positive and not greater than max_jobs")
+        if max_jobs > worker.max_jobs:
+            raise ValueError(f"max_jobs ({max_jobs}) exceeds the limit the worker was created with ({worker.max_jobs})")
+
+        self.worker = worker
+        self.min_jobs = min_jobs
+        self.max_jobs = max_jobs
+        self.target_lag_ms = target_lag_ms
+        self.target_wait_ms = target_wait_ms
+        self.max_error_rate = max_error_rate
+        self.increase_step = increase_step
+        self.decrease_factor = decrease_factor
+        self.interval = interval
+        self.tick = tick
+        self.min_finished_jobs = min_finished_jobs
+        self.metrics_key = f"{worker.queue_name}:concurrency:{socket.gethostname()}:{os.getpid()}"
+
+        self.limit = self._clamp(initial_jobs if initial_jobs is not None else worker.max_jobs)
+        self.worker.max_jobs = self.limit
+        self.last_decision = "initial"
+
+        self._task: Optional[asyncio.Task] = None
+        self._reset_window()
+
+    def _clamp(self, value: int) -> int:
+        return max(self.min_jobs, min(self.max_jobs, value))
+
+    def _reset_window(self) -> None:
+        self._max_lag_ms = 0.0
+        self._wait_total_ms = 0.0
+        self._wait_count = 0
+        self._finished_mark = (self.worker.jobs_complete, self.worker.jobs_failed, self.worker.jobs_retried)
+
+    def record_job_start(self, ctx: Dict[str, Any]) -> None:
+        """
+        Record how long a job waited in the queue. Called from the worker's `on_job_start` hook;
+        `score` is the time (ms) the job became runnable, so deferred jobs are not counted as waiting.
+        """
+        score = ctx.get("score")
+        if score:
+            self._wait_total_ms += max(0, timestamp_ms() - score)
+            self._wait_count += 1
+
+    def snapshot(self) -> Dict[str, Any]:
+        """
+        Current limit and the measurements of the window in progress.
+        """
+        complete, failed, retried = (
+            self.worker.jobs_complete - self._finished_mark[0],
+            self.worker.jobs_failed - self._finished_mark[1],
+            self.worker.jobs_retried - self._finished_mark[2],
+        )
+        finished = complete + failed + retried
+        return {
+            "limit": self.limit,
+            "min_jobs": self.min_jobs,
+            "max_jobs": self.max_jobs,
+            "in_flight": self.worker.job_counter,
+            "loop_lag_ms": round(self._max_lag_ms, 3),
+            "queue_wait_ms": round(self._wait_total_ms / self._wait_count, 3) if self._wait_count else 0.0,
+            "finished_jobs": finished,
+            "error_rate": round((failed + retried) / finished, 4) if finished else 0.0,
+            "decision": self.last_decision,
+        }
+
+    def adjust(self) -> Dict[str, Any]:
+        """
+        Close the current window, update the limit and return the metrics it was based on.
+        """
+        metrics = self.snapshot()
+        enough_samples = metrics["finished_jobs"] >= self.min_finished_jobs
+
+        if metrics["loop_lag_ms"] > self.target_lag_ms or (enough_samples and metrics["error_rate"] > self.max_error_rate):
+            new_limit = self._clamp(int(self.limit * self.decrease_factor))
+            decision = "decrease"
+        elif metrics["in_flight"] >= self.limit and metrics["queue_wait_ms"] > self.target_wait_ms:
+            new_limit = self._clamp(self.limit + self.increase_step)
+            decision = "increase"
+        else:
+            new_limit = self.limit
+            decision = "hold"
+
+        if new_limit == self.limit:
+            decision = "hold"
+        else:
+            logger.info("Concurrency %s: %d -> %d (%s)", decision, self.limit, new_limit, metrics)
+
+        self.limit = new_limit
+        self.worker.max_jobs = new_limit
+        self.last_decision = decision
+        metrics.update(limit=new_limit, decision=decision)
+
+        self._reset_window()
+        return metrics
+
+    async def publish(self, metrics: Dict[str, Any]) -> None:
+        """
+        Store the latest decision in Redis. The key expires if the worker stops reporting.
+        """
+        mapping = {key: str(value) for key, value in metrics.items()}
+        mapping["updated_at"] = str(timestamp_ms())
+        async with self.worker.pool.pipeline(transaction=True) as pipe:
+            pipe.hset(self.metrics_key, mapping=mapping)
+            pipe.pexpire(self.metrics_key, int(self.interval * 3000))
+            await pipe.execute()
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        window_end = time.monotonic() + self.interval
+        while True:
+            expected = loop.time() + self.tick
+            await asyncio.sleep(self.tick)
+            self._max_lag_ms = max(self._max_lag_ms, (loop.time() - expected) * 1000)
+
+            if time.monotonic() >= window_end:
+                window_end = time.monotonic() + self.interval
+                metrics = self.adjust()
+                try:
+                    await self.publish(metrics)
+                except Exception as exc:
+                    logger.warning("Could not publish concurrency metrics: %r", exc)
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
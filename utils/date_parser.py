@@ -4,6 +4,8 @@ import logging
 from datetime import datetime
 from typing import Optional
 
+logger = logging.getLogger(__name__)
+
 
 def parse_datetime_str(dt_str: Optional[str]) -> Optional[datetime]:
     if dt_str:
@@ -11,6 +13,6 @@ def parse_datetime_str(dt_str: Optional[str]) -> Optional[datetime]:
             # ARQ typically uses ISO format with timezone
             return datetime.fromisoformat(dt_str)
         except ValueError:
-            logging.warning(f"Could not parse datetime string: {dt_str}")
+            logger.warning("Could not parse datetime string: %s", dt_str)
             return None
     return None
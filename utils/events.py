@@ -1,12 +1,17 @@
-from database.models import configure
+from redis_pool import close_redis_pool
+from utils.logger import setup_logging
 
 
 async def on_start_up() -> None:
     """
-    Function to initialize the database.
+    Function to start the API's logging. The Redis pool and the database engine are
+    created on first use, and the schema is created by `python -m database.migrate`.
     """
-    configure()
+    setup_logging()
 
 
 async def on_shutdown() -> None:
-    pass
+    """
+    Function to close the shared Redis pool.
+    """
+    await close_redis_pool()
@@ -1,21 +1,42 @@
-import asyncio
-
-from arq.jobs import Job
+from arq.constants import in_progress_key_prefix, job_key_prefix, result_key_prefix
+from arq.jobs import Job, JobStatus, deserialize_job, deserialize_result
+from arq.utils import timestamp_ms
 
 from models import JobStatusResponse
+from utils.progress import parse_progress, progress_key
 
 
 async def process_job_info(job: Job) -> None | JobStatusResponse:
     start_time = None
 
-    # Get job info and result_info
-    job_info = await job.info()
+    # Read the job definition, result, status and progress in a single round trip
+    # instead of the separate calls job.info(), job.status() and job.result() make.
+    async with job._redis.pipeline(transaction=True) as pipe:
+        pipe.get(result_key_prefix + job.job_id)
+        pipe.get(job_key_prefix + job.job_id)
+        pipe.exists(in_progress_key_prefix + job.job_id)
+        pipe.zscore(job._queue_name, job.job_id)
+        pipe.hgetall(progress_key(job.job_id))
+        result_raw, job_raw, is_in_progress, score, progress_raw = await pipe.execute()
 
-    if job_info is None:
+    # Get job info and result_info
+    if result_raw:
+        job_info = deserialize_result(result_raw, deserializer=job._deserializer)
+    elif job_raw:
+        job_info = deserialize_job(job_raw, deserializer=job._deserializer)
+    else:
         return None
-
-    # Get job status
-    status = await job.status()
+    job_info.score = None if score is None else int(score)
+
+    # Get job status (same rules as arq's Job.status)
+    if result_raw:
+        status = JobStatus.complete
+    elif is_in_progress:
+        status = JobStatus.in_progress
+    elif score:
+        status = JobStatus.deferred if score > timestamp_ms() else JobStatus.queued
+    else:
+        status = JobStatus.not_found
 
     # Set enqueue_time as start_time if available
     start_time = getattr(job_info, "enqueue_time", None)
@@ -58,14 +79,15 @@ async def process_job_info(job: Job) -> None | JobStatusResponse:
         username = job_info.kwargs.get("username")
     data["username"] = username
 
-    # If job is complete, fetch result or error
+    # If job is complete, use the result or error read above
     if status.value == "complete":
-        try:
-            result = await job.result(timeout=5)
+        result = job_info.result
+        if job_info.success:
             data["result"] = result if isinstance(result, dict) else {"value": result}
-        except asyncio.TimeoutError:
-            data["error"] = "TimeoutError: Job took longer than 5 seconds to fetch result"
-        except Exception as e:
-            data["error"] = str(e)
+        else:
+            data["error"] = str(result)
+
+    # Merge the progress reported by the task, if any
+    data.update(parse_progress(progress_raw))
 
     return JobStatusResponse(**data)
@@ -0,0 +1,200 @@
+"""utils/logger.py
+
+Non-blocking, structured logging for the API and the worker.
+
+Records are put on an in-memory queue by a `QueueHandler` and written to stderr by a
+`QueueListener` thread, so logging never blocks the event loop on I/O. Each record is
+rendered as one JSON object (or plain text with LOG_FORMAT=text) and carries the
+job_id / function / try of the ARQ job it was logged from. INFO and DEBUG records of the
+loggers listed in LOG_SAMPLE_RATES are sampled; warnings and errors are always kept.
+"""
+
+import atexit
+import contextvars
+import copy
+import functools
+import json
+import logging
+import queue
+import random
+import sys
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+from typing import Any, Dict, Optional
+
+from config import get_settings
+
+# Job context, bound by `log_job_context` (tasks) and `bind_job_context` (worker hooks)
+job_id_var: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("job_id", default=None)
+function_var: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("function", default=None)
+job_try_var: contextvars.ContextVar[Optional[int]] = contextvars.ContextVar("job_try", default=None)
+
+# Pass to the arq CLI so it keeps this configuration instead of adding its own handler:
+#   arq worker:WorkerSettings --custom-log-dict utils.logger.ARQ_LOG_CONFIG
+ARQ_LOG_CONFIG: Dict[str, Any] = {"version": 1, "disable_existing_loggers": False}
+
+# Attributes every LogRecord has; anything else was passed through `extra=`
+_RECORD_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime", "job_id", "function", "job_try"}
+
+_listener: Optional[QueueListener] = None
+
+
+def bind_job_context(ctx: dict, function: Optional[str] = None) -> None:
+    """
+    Attach the job_id / try (and function, if known) of an ARQ job context to
+    every record logged from the current asyncio task.
+    """
+    job_id_var.set(ctx.get("job_id"))
+    job_try_var.set(ctx.get("job_try"))
+    if function is not None:
+        function_var.set(function)
+
+
+def log_job_context(func):
+    """
+    Decorator for ARQ task functions: binds the job context, including the
+    function name, for everything the task logs.
+    """
+
+    @functools.wraps(func)
+    async def wrapper(ctx, *args, **kwargs):
+        bind_job_context(ctx, func.__name__)
+        return await func(ctx, *args, **kwargs)
+
+    return wrapper
+
+
+class JobContextFilter(logging.Filter):
+    """Copies the job context variables onto the record."""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if not hasattr(record, "job_id"):
+            record.job_id = job_id_var.get()
+        if not hasattr(record, "function"):
+            record.function = function_var.get()
+        if not hasattr(record, "job_try"):
+            record.job_try = job_try_var.get()
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Keeps only a fraction of the INFO/DEBUG records of selected loggers (and their children).
+    """
+
+    def __init__(self, rates: Dict[str, float]):
+        super().__init__()
+        self.rates = rates
+        self._cache: Dict[str, float] = {}
+
+    def _rate(self, name: str) -> float:
+        rate = self._cache.get(name)
+        if rate is None:
+            rate = 1.0
+            # The most specific configured logger wins, e.g. "arq.worker" over "arq"
+            for prefix in sorted(self.rates, key=len, reverse=True):
+                if name == prefix or name.startswith(prefix + "."):
+                    rate = self.rates[prefix]
+                    break
+            self._cache[name] = rate
+        return rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno > logging.INFO:
+            return True
+        rate = self._rate(record.name)
+        return rate >= 1.0 or random.random() < rate
+
+
+class JsonFormatter(logging.Formatter):
+    """Renders a record as a single JSON line."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        data: Dict[str, Any] = {
+            "time": datetime.fromtimestamp(record.created, tz=timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for field in ("job_id", "function", "job_try"):
+            value = getattr(record, field, None)
+            if value is not None:
+                data[field] = value
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRS and not key.startswith("_"):
+                data[key] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            data["exc_info"] = record.exc_text
+        return json.dumps(data, default=str)
+
+
+class _QueueHandler(QueueHandler):
+    """
+    QueueHandler that leaves formatting to the listener. The stdlib version formats the
+    record (traceback included) into `msg`, which would flatten our JSON fields.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+def stop_logging() -> None:
+    """Flush and stop the listener thread."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+def setup_logging(force: bool = False) -> None:
+    """
+    Route the root logger through a queue to a background writer thread.
+
+    Safe to call more than once; pass `force=True` in a forked process, where the
+    parent's listener thread does not exist.
+    """
+    global _listener
+    if _listener is not None and not force:
+        return
+
+    settings = get_settings()
+    root = logging.getLogger()
+
+    if force:
+        # Do not join the listener inherited from the parent: its thread is not running here
+        _listener = None
+    else:
+        stop_logging()
+    for handler in list(root.handlers):
+        if isinstance(handler, QueueHandler):
+            root.removeHandler(handler)
+
+    log_queue: queue.SimpleQueue = queue.SimpleQueue()
+    queue_handler = _QueueHandler(log_queue)
+    # Filters run in the calling thread: sampling drops records before they are copied,
+    # and the context variables are only visible from the task that logged the record.
+    queue_handler.addFilter(SamplingFilter(settings.LOG_SAMPLE_RATES))
+    queue_handler.addFilter(JobContextFilter())
+
+    stream_handler = logging.StreamHandler(sys.stderr)
+    if settings.LOG_FORMAT == "json":
+        stream_handler.setFormatter(JsonFormatter())
+    else:
+        stream_handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s [%(job_id)s] %(message)s"))
+
+    root.addHandler(queue_handler)
+    root.setLevel(settings.LOG_LEVEL.upper())
+
+    _listener = QueueListener(log_queue, stream_handler, respect_handler_level=True)
+    _listener.start()
+
+
+atexit.register(stop_logging)
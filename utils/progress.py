@@ -0,0 +1,74 @@
+"""utils/progress.py"""
+
+import time
+from typing import Any, Dict, Optional
+
+from arq.utils import timestamp_ms
+
+# One hash per job, refreshed on every write and removed by Redis once the TTL passes
+PROGRESS_KEY_PREFIX = "arq:progress:"
+PROGRESS_TTL_S = 24 * 3600
+
+# Writes closer together than this are dropped, except the first, the final (100%) one and
+# any write that changes the message, so a new step is never hidden behind an old one
+PROGRESS_MIN_INTERVAL_S = 1.0
+
+
+def progress_key(job_id: str) -> str:
+    return PROGRESS_KEY_PREFIX + job_id
+
+
+async def report_progress(ctx: dict, pct: float, message: Optional[str] = None, force: bool = False) -> bool:
+    """
+    Record the progress of the running job in Redis.
+
+    Args:
+        ctx (dict): The ARQ job context. Expected to contain 'job_id' and 'redis'.
+        pct (float): Completion percentage, clamped to 0-100.
+        message (Optional[str]): Short description of the current step.
+        force (bool): Write even if the last write was less than
+                      `PROGRESS_MIN_INTERVAL_S` seconds ago.
+
+    Returns:
+        bool: True if the progress was written, False if it was rate-limited.
+              Only percentage updates with an unchanged message are rate-limited.
+    """
+    pct = max(0.0, min(100.0, float(pct)))
+    message = message or ""
+
+    # ctx is created per job run, so it is a safe place to keep the rate-limit state
+    now = time.monotonic()
+    last_write = ctx.get("_progress_written_at")
+    same_message = message == ctx.get("_progress_message")
+    if not force and pct < 100 and same_message and last_write is not None and now - last_write < PROGRESS_MIN_INTERVAL_S:
+        return False
+    ctx["_progress_written_at"] = now
+    ctx["_progress_message"] = message
+
+    key = progress_key(ctx["job_id"])
+    mapping = {
+        "pct": pct,
+        "message": message,
+        "job_try": ctx.get("job_try", 1),
+        "updated_at": timestamp_ms(),
+    }
+    async with ctx["redis"].pipeline(transaction=False) as pipe:
+        pipe.hset(key, mapping=mapping)
+        pipe.expire(key, PROGRESS_TTL_S)
+        await pipe.execute()
+    return True
+
+
+def parse_progress(raw: Dict[Any, Any]) -> Dict[str, Any]:
+    """
+    Convert a progress hash as returned by HGETALL (bytes keys and values) into
+    the `progress` / `progress_message` fields of `JobStatusResponse`.
+    """
+    if not raw:
+        return {"progress": None, "progress_message": None}
+
+    data = {(k.decode() if isinstance(k, bytes) else k): (v.decode() if isinstance(v, bytes) else v) for k, v in raw.items()}
+    return {
+        "progress": float(data["pct"]) if data.get("pct") else None,
+        "progress_message": data.get("message") or None,
+    }
@@ -0,0 +1,354 @@
+"""utils/workflows.py
+
+Chains, groups and chords on top of `ArqRedis.enqueue_job`.
+
+    - chain: steps run one after another; each step receives the previous step's result
+      as its first argument. The chain stops at the first failure.
+    - group: all jobs are enqueued at once (fan-out).
+    - chord: a group plus a callback that is enqueued once every member has succeeded,
+      receiving the list of member results as its first argument (fan-in).
+
+Members get the job id `wf:{workflow_id}:{index}` (the chord callback `wf:{workflow_id}:callback`),
+so the worker's `after_job_end` hook can tell workflow jobs apart without a Redis lookup.
+Progress is tracked with HINCRBY counters on the workflow hash: each member costs one
+script call, and only the member that brings `finished` up to `total` triggers the next step.
+
+ARQ does not call `after_job_end` for every failure (unknown function, max tries exceeded,
+expired or aborted jobs), but it still stores a result for them. And a worker can die between
+recording a member and enqueueing the next chain step or the chord callback. Running workflows
+are therefore kept in a sorted set that the worker sweeps periodically (`run_workflow_sweeper`):
+members with a result are recorded, and a next step that is neither queued, running nor finished
+is enqueued again. A `done:<member>` field makes recording idempotent, and the fixed member job
+ids make enqueueing idempotent, so the hook and the sweeper can race.
+"""
+
+import asyncio
+import json
+import logging
+from typing import Any, Dict, List, Optional, Tuple
+from uuid import uuid4
+
+from arq.connections import ArqRedis
+from arq.constants import in_progress_key_prefix, job_key_prefix, result_key_prefix
+from arq.jobs import Job, JobResult, deserialize_result
+from arq.utils import ms_to_datetime, timestamp_ms
+from redis.commands.core import AsyncScript
+
+logger = logging.getLogger(__name__)
+
+WORKFLOW_KEY_PREFIX = "arq:workflow:"
+# Ids of running workflows, scored by creation time
+RUNNING_KEY = "arq:workflows:running"
+WORKFLOW_JOB_PREFIX = "wf:"
+WORKFLOW_TTL_S = 7 * 24 * 3600
+CALLBACK = "callback"
+# The first member(s) are enqueued by the request that starts the workflow; one still missing
+# after this long never will be (seconds)
+START_GRACE_S = 60
+# How often each worker sweeps the running workflows (seconds)
+SWEEP_INTERVAL_S = 60
+
+# Marks the member as done and bumps the counters, once per member.
+# Returns nil if the member was already recorded or the workflow no longer exists.
+RECORD_MEMBER_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    return nil
+end
+if redis.call('HSETNX', KEYS[1], 'done:' .. ARGV[1], 1) == 0 then
+    return nil
+end
+redis.call('HINCRBY', KEYS[1], ARGV[2], 1)
+local finished = redis.call('HINCRBY', KEYS[1], 'finished', 1)
+local state = redis.call('HMGET', KEYS[1], 'kind', 'total', 'failed')
+return {finished, state[1], state[2], state[3]}
+"""
+
+_record_member_script: Optional[AsyncScript] = None
+
+
+def workflow_key(workflow_id: str) -> str:
+    return WORKFLOW_KEY_PREFIX + workflow_id
+
+
+def member_job_id(workflow_id: str, member: int | str) -> str:
+    return f"{WORKFLOW_JOB_PREFIX}{workflow_id}:{member}"
+
+
+def parse_member_job_id(job_id: Optional[str]) -> Optional[Tuple[str, str]]:
+    """
+    Return (workflow_id, member) for a workflow job id, or None for any other job.
+    """
+    if not job_id or not job_id.startswith(WORKFLOW_JOB_PREFIX):
+        return None
+    workflow_id, _, member = job_id[len(WORKFLOW_JOB_PREFIX) :].rpartition(":")
+    if not workflow_id:
+        return None
+    return workflow_id, member
+
+
+async def _enqueue_step(redis: ArqRedis, job_id: str, step: Dict[str, Any], *prepend: Any) -> None:
+    await redis.enqueue_job(step["function"], *prepend, *step.get("args", []), _job_id=job_id, **step.get("kwargs", {}))
+
+
+def workflow_job_ids(workflow_id: str, kind: str, size: int) -> List[str]:
+    """
+    Ids of every job a workflow can run: its members and, for a chord, the callback.
+    """
+    job_ids = [member_job_id(workflow_id, index) for index in range(size)]
+    if kind == "chord":
+        job_ids.append(member_job_id(workflow_id, CALLBACK))
+    return job_ids
+
+
+async def start_workflow(
+    redis: ArqRedis,
+    kind: str,
+    steps: List[Dict[str, Any]],
+    callback: Optional[Dict[str, Any]] = None,
+    workflow_id: Optional[str] = None,
+) -> Tuple[str, List[str]]:
+    """
+    Create the workflow hash and enqueue its first job(s).
+
+    Args:
+        redis (ArqRedis): ARQ Redis connection.
+        kind (str): "chain", "group" or "chord".
+        steps (List[Dict[str, Any]]): Jobs as {"function": ..., "args": [...], "kwargs": {...}}.
+        callback (Optional[Dict[str, Any]]): Chord callback, in the same format.
+        workflow_id (Optional[str]): Id to use, e.g. when the job ids were needed up front
+                                     for admission control. A new one is generated if omitted.
+
+    Returns:
+        Tuple[str, List[str]]: The workflow id and the ids of all member jobs.
+    """
+    if kind not in ("chain", "group", "chord"):
+        raise ValueError(f"Unknown workflow kind: {kind}")
+    if not steps:
+        raise ValueError("A workflow needs at least one job")
+    if (kind == "chord") != (callback is not None):
+        raise ValueError("A callback is required for chords and only allowed for chords")
+
+    workflow_id = workflow_id or uuid4().hex
+    key = workflow_key(workflow_id)
+    mapping = {
+        "kind": kind,
+        "status": "running",
+        "total": len(steps),
+        "finished": 0,
+        "succeeded": 0,
+        "failed": 0,
+        "created_at": timestamp_ms(),
+    }
+    # Only chains need the remaining steps later; groups are fully enqueued up front
+    if kind == "chain":
+        mapping["steps"] = json.dumps(steps)
+    if callback is not None:
+        mapping["callback"] = json.dumps(callback)
+
+    # The hash has to exist before any member can finish
+    async with redis.pipeline(transaction=True) as pipe:
+        pipe.hset(key, mapping=mapping)
+        pipe.expire(key, WORKFLOW_TTL_S)
+        pipe.zadd(RUNNING_KEY, {workflow_id: mapping["created_at"]})
+        await pipe.execute()
+
+    job_ids = [member_job_id(workflow_id, index) for index in range(len(steps))]
+    if kind == "chain":
+        await _enqueue_step(redis, job_ids[0], steps[0])
+    else:
+        for job_id, step in zip(job_ids, steps):
+            await _enqueue_step(redis, job_id, step)
+
+    return workflow_id, job_ids
+
+
+async def _finish_workflow(redis: ArqRedis, workflow_id: str, status: str) -> None:
+    async with redis.pipeline(transaction=True) as pipe:
+        pipe.hset(workflow_key(workflow_id), mapping={"status": status, "finished_at": timestamp_ms()})
+        pipe.zrem(RUNNING_KEY, workflow_id)
+        await pipe.execute()
+
+
+async def _enqueue_next_step(redis: ArqRedis, workflow_id: str, index: int, previous_result: Any) -> None:
+    steps = json.loads(await redis.hget(workflow_key(workflow_id), "steps"))
+    await _enqueue_step(redis, member_job_id(workflow_id, index), steps[index], previous_result)
+
+
+async def _enqueue_callback(redis: ArqRedis, workflow_id: str, total: int) -> None:
+    # Collect the member results in order and hand them to the callback
+    raw_results = await redis.mget([result_key_prefix + member_job_id(workflow_id, index) for index in range(total)])
+    results = [deserialize_result(raw, deserializer=redis.job_deserializer).result if raw else None for raw in raw_results]
+    callback = json.loads(await redis.hget(workflow_key(workflow_id), "callback"))
+    await _enqueue_step(redis, member_job_id(workflow_id, CALLBACK), callback, results)
+
+
+async def advance_workflow(ctx: dict) -> None:
+    """
+    ARQ `after_job_end` hook: records the outcome of a workflow member and enqueues
+    whatever comes next (the next chain step or the chord callback).
+
+    Jobs that are not part of a workflow return immediately. Jobs that will be retried
+    have no result yet and are skipped until their final run.
+    """
+    parsed = parse_member_job_id(ctx.get("job_id"))
+    if parsed is None:
+        return
+    workflow_id, member = parsed
+    redis: ArqRedis = ctx["redis"]
+
+    result_info = await Job(ctx["job_id"], redis, _deserializer=redis.job_deserializer).result_info()
+    if result_info is None:
+        return
+    await _member_finished(redis, workflow_id, member, result_info)
+
+
+async def _member_finished(redis: ArqRedis, workflow_id: str, member: str, result_info: JobResult) -> None:
+    """
+    Record a finished member and enqueue whatever comes next. Safe to call more than once
+    for the same member: only the first call has any effect.
+    """
+    if member == CALLBACK:
+        await _finish_workflow(redis, workflow_id, "complete" if result_info.success else "failed")
+        return
+
+    global _record_member_script
+    if _record_member_script is None:
+        _record_member_script = redis.register_script(RECORD_MEMBER_SCRIPT)
+
+    key = workflow_key(workflow_id)
+    recorded = await _record_member_script(keys=[key], args=[member, "succeeded" if result_info.success else "failed"], client=redis)
+    if recorded is None:
+        # Already recorded, or the workflow hash expired or was deleted
+        return
+    finished, kind, total, failed = recorded
+    kind, total, failed = kind.decode(), int(total), int(failed)
+
+    if kind == "chain":
+        if not result_info.success:
+            await _finish_workflow(redis, workflow_id, "failed")
+            return
+        next_index = int(member) + 1
+        if next_index >= total:
+            await _finish_workflow(redis, workflow_id, "complete")
+            return
+        await _enqueue_next_step(redis, workflow_id, next_index, result_info.result)
+        return
+
+    # group / chord: only the last member to finish gets here
+    if finished < total:
+        return
+
+    if kind == "group" or failed:
+        await _finish_workflow(redis, workflow_id, "complete" if not failed else "failed")
+        return
+
+    await _enqueue_callback(redis, workflow_id, total)
+
+
+async def catch_up_workflow(redis: ArqRedis, workflow_id: str) -> None:
+    """
+    Bring a running workflow up to date without the `after_job_end` hook: record pending
+    members that have a result, and enqueue again a next chain step or chord callback that
+    is neither queued, running nor finished (the worker died before enqueueing it).
+    A member the starting request never enqueued fails the workflow instead: that request
+    failed, so the client does not expect the workflow to run.
+    """
+    raw = await redis.hgetall(workflow_key(workflow_id))
+    if not raw or raw.get(b"status") != b"running":
+        # Finished, or the hash has expired
+        await redis.zrem(RUNNING_KEY, workflow_id)
+        return
+
+    data = {k.decode(): v.decode() for k, v in raw.items()}
+    kind, total, finished, failed = data["kind"], int(data["total"]), int(data["finished"]), int(data["failed"])
+    if kind == "chain":
+        # Steps run one at a time, so only the current one can be pending
+        members = [str(finished)] if finished < total and not failed else []
+    else:
+        members = [str(index) for index in range(total) if f"done:{index}" not in data]
+        if kind == "chord" and not members and not failed:
+            members = [CALLBACK]
+    if not members:
+        # Every member is recorded, but the worker died before finishing the workflow
+        await _finish_workflow(redis, workflow_id, "failed" if failed else "complete")
+        return
+
+    async with redis.pipeline(transaction=False) as pipe:
+        for member in members:
+            job_id = member_job_id(workflow_id, member)
+            pipe.get(result_key_prefix + job_id)
+            pipe.exists(job_key_prefix + job_id, in_progress_key_prefix + job_id)
+        replies = await pipe.execute()
+
+    for member, raw_result, queued_or_running in zip(members, replies[::2], replies[1::2]):
+        if raw_result is not None:
+            await _member_finished(redis, workflow_id, member, deserialize_result(raw_result, deserializer=redis.job_deserializer))
+        elif queued_or_running:
+            continue
+        elif member == CALLBACK:
+            logger.warning("Enqueueing missing chord callback", extra={"workflow_id": workflow_id})
+            await _enqueue_callback(redis, workflow_id, total)
+        elif kind == "chain" and finished:
+            raw_previous = await redis.get(result_key_prefix + member_job_id(workflow_id, finished - 1))
+            if raw_previous is None:
+                # The previous result has expired, so there is nothing to hand to this step
+                await _finish_workflow(redis, workflow_id, "failed")
+                return
+            logger.warning("Enqueueing missing chain step", extra={"workflow_id": workflow_id, "member": member})
+            await _enqueue_next_step(redis, workflow_id, finished, deserialize_result(raw_previous, deserializer=redis.job_deserializer).result)
+        elif timestamp_ms() - int(data["created_at"]) > START_GRACE_S * 1000:
+            # The request that started the workflow failed before enqueueing this member
+            logger.warning("Workflow member was never enqueued", extra={"workflow_id": workflow_id, "member": member})
+            await _finish_workflow(redis, workflow_id, "failed")
+            return
+
+
+async def sweep_workflows(redis: ArqRedis) -> int:
+    """
+    Run `catch_up_workflow` for every running workflow.
+
+    Returns:
+        int: The number of workflows checked.
+    """
+    workflow_ids = [workflow_id.decode() for workflow_id in await redis.zrange(RUNNING_KEY, 0, -1)]
+    for workflow_id in workflow_ids:
+        await catch_up_workflow(redis, workflow_id)
+    return len(workflow_ids)
+
+
+async def run_workflow_sweeper(redis: ArqRedis, interval: float = SWEEP_INTERVAL_S) -> None:
+    """
+    Run `sweep_workflows` every `interval` seconds until cancelled. Started by the
+    worker; with several workers each one sweeps, which is harmless since catching up is idempotent.
+    """
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await sweep_workflows(redis)
+        except Exception:
+            logger.exception("Workflow sweep failed")
+
+
+async def get_workflow(redis: ArqRedis, workflow_id: str) -> Optional[Dict[str, Any]]:
+    """
+    Return the state of a workflow, or None if it does not exist (or has expired).
+    """
+    raw = await redis.hgetall(workflow_key(workflow_id))
+    if not raw:
+        return None
+
+    data = {k.decode(): v.decode() for k, v in raw.items()}
+    total = int(data["total"])
+    return {
+        "workflow_id": workflow_id,
+        "kind": data["kind"],
+        "status": data["status"],
+        "total": total,
+        "finished": int(data["finished"]),
+        "succeeded": int(data["succeeded"]),
+        "failed": int(data["failed"]),
+        "job_ids": [member_job_id(workflow_id, index) for index in range(total)],
+        "callback_job_id": member_job_id(workflow_id, CALLBACK) if data["kind"] == "chord" else None,
+        "created_at": ms_to_datetime(int(data["created_at"])).isoformat(),
+        "finished_at": ms_to_datetime(int(data["finished_at"])).isoformat() if "finished_at" in data else None,
+    }
@@ -1,32 +1,89 @@
 # worker.py
 
+import asyncio
+import logging
+import os
+import socket
 
-from arq.connections import RedisSettings
 from arq.jobs import Job
+from arq.worker import create_worker
 from httpx import AsyncClient
 
-from config import get_settings
+import tasks
+from config import get_redis_settings, get_settings
 from database.connection import get_db
 from schemas.models import JobHistoryCreate
-from tasks import add, divide, long_call, scheduled_add
+from task_names import TASK_NAMES
+from utils.admission import release_admission, run_admission_sweeper, unregister_worker
+from utils.concurrency import AdaptiveConcurrencyController
 from utils.date_parser import parse_datetime_str
 from utils.job_info import process_job_info
 from utils.job_info_crud import create_job_history
+from utils.logger import bind_job_context, setup_logging
+from utils.workflows import WORKFLOW_TTL_S, advance_workflow, run_workflow_sweeper
 
 # Configuration settings
 config = get_settings()
 
+# Logging is set up by `run_worker`, or by `startup` under the arq CLI
+logger = logging.getLogger(__name__)
+
 # Configure Redis connection
-REDIS_SETTINGS = RedisSettings(host=config.redis_host, port=config.redis_port)
+REDIS_SETTINGS = get_redis_settings()
 
 
 # ARQ startup and shutdown
 async def startup(ctx):
+    setup_logging()
     ctx["session"] = AsyncClient()
 
+    # Only present when the worker is started with `run_worker` (python worker.py)
+    controller = ctx.get("concurrency")
+
+    # Sends the number of jobs this worker runs at once, which fair sharing divides between
+    # users, and frees admission slots of jobs that ended without `after_job_end`
+    def slots() -> int:
+        return controller.limit if controller else WorkerSettings.max_jobs
+
+    # Taken here, not on import: supervisor.py forks its workers after importing this module
+    ctx["worker_id"] = f"{socket.gethostname()}:{os.getpid()}"
+    ctx["admission_sweeper"] = asyncio.create_task(run_admission_sweeper(ctx["redis"], ctx["worker_id"], slots))
+    # Advances workflows whose members ended without `after_job_end`, or whose next step was never enqueued
+    ctx["workflow_sweeper"] = asyncio.create_task(run_workflow_sweeper(ctx["redis"]))
+
+    if controller:
+        controller.start()
+
 
 async def shutdown(ctx):
-    await ctx["session"].aclose()
+    for name in ("admission_sweeper", "workflow_sweeper"):
+        sweeper = ctx.get(name)
+        if sweeper:
+            sweeper.cancel()
+    # Stop counting this worker's slots right away instead of when its registration expires
+    if "worker_id" in ctx:
+        await unregister_worker(ctx["redis"], ctx["worker_id"])
+
+    controller = ctx.get("concurrency")
+    if controller:
+        await controller.stop()
+
+    # The session is missing if the worker failed before `startup` ran
+    session = ctx.get("session")
+    if session:
+        await session.aclose()
+
+
+async def record_job_start(ctx):
+    """
+    ARQ `on_job_start` hook: binds the job context for logging and feeds the
+    queue wait time of each job to the adaptive concurrency controller, if one is running.
+    """
+    bind_job_context(ctx)
+
+    controller = ctx.get("concurrency")
+    if controller:
+        controller.record_job_start(ctx)
 
 
 async def save_job_history_to_db(ctx: dict):
@@ -49,8 +106,7 @@ async def save_job_history_to_db(ctx: dict):
 
     # Basic validation: job_id and redis are essential
     if not job_id or not redis:
-        # Consider using logger.error here for better logging
-        print(f"Error: job_id or redis not found in context for on_job_end. Job ID: {job_id}")
+        logger.error("job_id or redis not found in context for on_job_end", extra={"job_id": job_id})
         return
 
     # Create an ARQ Job instance to interact with the job's data in Redis
@@ -62,8 +118,7 @@ async def save_job_history_to_db(ctx: dict):
 
     # If job_info couldn't be retrieved (e.g., job details not found in Redis), log and exit.
     if not job_info:
-        # Consider using logger.error
-        print(f"Error: Could not retrieve job_info for job_id {job_id}. Skipping DB save.")
+        logger.error("Could not retrieve job_info, skipping DB save")
         return
 
     # Prepare a dictionary with data extracted from job_info.
@@ -90,9 +145,7 @@ async def save_job_history_to_db(ctx: dict):
     try:
         job_history_to_save = JobHistoryCreate(**job_history_data_dict)
     except Exception as e:  # Catch Pydantic validation errors or others
-        # Consider using logger.error with exc_info=True for full traceback
-        print(f"Error creating JobHistoryCreate model for job {job_id}: {e}")
-        print(f"Data causing error: {job_history_data_dict}")
+        logger.error("Error creating JobHistoryCreate model: %s", e, extra={"data": job_history_data_dict}, exc_info=True)
         return
 
     # Get a database session using the get_db generator
@@ -106,18 +159,61 @@ async def save_job_history_to_db(ctx: dict):
         create_job_history(db=db, job_history_in=job_history_to_save)
 
     except Exception as e_db:
-        # Consider using logger.error with exc_info=True
-        print(f"Error saving job history for {job_id} to database: {e_db}")
+        logger.error("Error saving job history to database: %s", e_db, exc_info=True)
+
+
+async def after_job_end(ctx: dict):
+    """
+    ARQ `after_job_end` hook: gives the job's admission slot back, advances the job's
+    workflow, if it belongs to one, then saves the job history to the database.
+    """
+    bind_job_context(ctx)
+    await release_admission(ctx)
+    await advance_workflow(ctx)
+    await save_job_history_to_db(ctx)
 
 
 # Worker settings for ARQ
 class WorkerSettings:
-    functions = [long_call, add, divide, scheduled_add]
+    # Exactly the names the API accepts in workflows
+    functions = [getattr(tasks, name) for name in TASK_NAMES]
     on_startup = startup
     on_shutdown = shutdown
-    after_job_end = save_job_history_to_db
-    keep_result_forever = True
+    on_job_start = record_job_start
+    after_job_end = after_job_end
+    # Not keep_result_forever: ARQ then stores failed results with `PX 0`, which Redis rejects, so
+    # jobs failing before they run (max tries, unknown function, expired) would have no result.
+    # Results outlive the workflows that read them; the job history database keeps them for good.
+    keep_result = WORKFLOW_TTL_S
     max_jobs = 100
     max_tries = 3
     queue_name = config.WORKER_QUEUE
     redis_settings = REDIS_SETTINGS
+
+
+def run_worker(**kwargs) -> None:
+    """
+    Run the worker with adaptive concurrency.
+
+    `WorkerSettings.max_jobs` is used as the starting limit; the controller then moves it
+    between `WORKER_MIN_JOBS` and `WORKER_MAX_JOBS` based on event-loop lag, queue wait
+    time and error rate. `arq worker:WorkerSettings` still runs with the static limit.
+
+    Any keyword arguments are passed on to the ARQ `Worker`.
+    """
+    setup_logging()
+    arq_worker = create_worker(WorkerSettings, max_jobs=config.WORKER_MAX_JOBS, **kwargs)
+    arq_worker.ctx["concurrency"] = AdaptiveConcurrencyController(
+        arq_worker,
+        min_jobs=config.WORKER_MIN_JOBS,
+        max_jobs=config.WORKER_MAX_JOBS,
+        initial_jobs=WorkerSettings.max_jobs,
+        target_lag_ms=config.WORKER_TARGET_LOOP_LAG_MS,
+        target_wait_ms=config.WORKER_TARGET_WAIT_MS,
+        max_error_rate=config.WORKER_MAX_ERROR_RATE,
+    )
+    arq_worker.run()
+
+
+if __name__ == "__main__":
+    run_worker()